@@ -1,166 +1,97 @@
 import os
-import json
-import psycopg2
 from typing import Dict, Any
-from decimal import Decimal
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    Business: Активация карты и начисление бонуса 500₽
-    Args: event с telegram_id пользователя
-    Returns: HTTP response с новым балансом
-    '''
-    method: str = event.get('httpMethod', 'POST')
+from db import connection
+from ledger import posting_ctes
+from rate_limit import limiter_from_env
+from runtime import HttpError, Router, json_response, parse_json_body
+from telegram_auth import authenticate
+
+router = Router()
+limiter = limiter_from_env('activate-card')
+
+ADMIN_TELEGRAM_IDS = frozenset(
+    int(value) for value in os.environ.get('ADMIN_TELEGRAM_IDS', '').split(',') if value.strip().isdigit()
+)
+
+CARD_BONUS = 500
+REFERRAL_BONUS = 200
+
+ACTIVATE_CARD_SQL = '''
+    WITH candidate AS (
+        SELECT telegram_id, referred_by, card_status
+        FROM users
+        WHERE telegram_id = %(telegram_id)s AND card_status <> 'activated'
+        FOR UPDATE
+    ), event AS (
+        INSERT INTO card_status_events (idempotency_key, telegram_id, from_status, to_status, source, applied)
+        SELECT 'admin:activated:' || telegram_id, telegram_id, card_status, 'activated', 'admin', TRUE
+        FROM candidate
+        ON CONFLICT (idempotency_key) DO NOTHING
+    ),''' + posting_ctes('''
+        SELECT telegram_id, %(bonus)s::numeric, 'card_bonus', 'card_bonus:' || telegram_id
+        FROM candidate
+        UNION ALL
+        SELECT c.referred_by, %(referral_bonus)s::numeric, 'referral_bonus', 'referral_bonus:' || c.telegram_id
+        FROM candidate c
+        JOIN users r ON r.telegram_id = c.referred_by AND r.telegram_id <> c.telegram_id
+    ''', extra_assignments='''
+        card_ordered = u.card_ordered OR 'card_bonus' = ANY(e.kinds),
+        card_activated = u.card_activated OR 'card_bonus' = ANY(e.kinds),
+        card_status = CASE WHEN 'card_bonus' = ANY(e.kinds) THEN 'activated' ELSE u.card_status END''') + ''', queued AS (
+        INSERT INTO notification_outbox (chat_id, kind, params)
+        SELECT telegram_id, CASE kind WHEN 'card_bonus' THEN 'card_activated' ELSE kind END,
+            jsonb_build_object('balance', balance)
+        FROM credited, unnest(kinds) AS kind
+    )
+    SELECT balance FROM credited WHERE 'card_bonus' = ANY(kinds)
+'''
+
+
+@router.route('POST')
+def activate_card(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    telegram_id = parse_json_body(event).get('telegram_id')
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    if not telegram_id:
+        raise HttpError(400, 'telegram_id is required')
     
-    if method == 'POST':
-        try:
-            body_data = json.loads(event.get('body', '{}'))
-            telegram_id = body_data.get('telegram_id')
-            
-            if not telegram_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'telegram_id is required'})
-                }
-            
-            dsn = os.environ.get('DATABASE_URL', '')
-            
-            conn = psycopg2.connect(dsn)
-            cur = conn.cursor()
-            
-            cur.execute(
-                "SELECT balance, card_activated FROM users WHERE telegram_id = %s",
-                (telegram_id,)
-            )
+    admin = authenticate(event, telegram_id)
+    if not admin.get('unsigned') and admin['telegram_id'] not in ADMIN_TELEGRAM_IDS:
+        raise HttpError(403, 'Card activation is allowed for admins only')
+    
+    limiter.check(event, telegram_id)
+    
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(ACTIVATE_CARD_SQL, {
+                'bonus': CARD_BONUS,
+                'referral_bonus': REFERRAL_BONUS,
+                'telegram_id': telegram_id,
+            })
             result = cur.fetchone()
             
             if not result:
-                return {
-                    'statusCode': 404,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'User not found'})
-                }
-            
-            current_balance, card_activated = result
-            
-            if card_activated:
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Card already activated', 'balance': float(current_balance)})
-                }
-            
-            new_balance = Decimal(str(current_balance)) + Decimal('500.00')
-            
-            cur.execute(
-                "UPDATE users SET balance = %s, card_activated = TRUE, updated_at = CURRENT_TIMESTAMP WHERE telegram_id = %s",
-                (new_balance, telegram_id)
-            )
-            conn.commit()
-            
-            cur.close()
-            conn.close()
-            
-            bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
-            if bot_token:
-                import urllib.request
-                
-                message_text = (
-                    "🎉 *Поздравляем!*\n\n"
-                    f"Ваша карта успешно активирована!\n"
-                    f"💰 Бонус *500₽* зачислен на ваш баланс!\n\n"
-                    f"Ваш новый баланс: *{float(new_balance)}₽*\n\n"
-                    "Теперь вы можете:\n"
-                    "• Вывести средства через СБП\n"
-                    "• Пригласить друзей и получить ещё больше!\n\n"
-                    "Откройте приложение, чтобы продолжить 👇"
-                )
-                
-                send_data = {
-                    'chat_id': telegram_id,
-                    'text': message_text,
-                    'parse_mode': 'Markdown',
-                    'reply_markup': {
-                        'inline_keyboard': [[
-                            {
-                                'text': '🚀 Открыть приложение',
-                                'web_app': {'url': 'https://alpha-card-project--preview.poehali.dev/'}
-                            }
-                        ]]
-                    }
-                }
-                
-                send_url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
-                req_data = json.dumps(send_data).encode('utf-8')
-                req = urllib.request.Request(
-                    send_url,
-                    data=req_data,
-                    headers={'Content-Type': 'application/json'}
-                )
-                
-                try:
-                    with urllib.request.urlopen(req) as response:
-                        response.read()
-                except Exception:
-                    pass
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({
-                    'success': True,
-                    'balance': float(new_balance),
-                    'bonus': 500
-                })
-            }
-            
-        except Exception as e:
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': str(e)})
-            }
+                cur.execute("SELECT balance FROM users WHERE telegram_id = %s", (telegram_id,))
+                existing = cur.fetchone()
+        conn.commit()
     
-    return {
-        'statusCode': 405,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'isBase64Encoded': False,
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+    if not result and not existing:
+        raise HttpError(404, 'User not found')
+    
+    if not result:
+        raise HttpError(400, 'Card already activated', balance=existing[0])
+    
+    return json_response(200, {
+        'success': True,
+        'balance': result[0],
+        'bonus': CARD_BONUS
+    })
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Активация карты, начисление бонуса 500₽ и 200₽ пригласившему
+    Args: event с telegram_id пользователя и X-Telegram-Init-Data администратора
+    Returns: HTTP response с новым балансом
+    '''
+    return router.dispatch(event, context)
@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+import tracing
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '5'))
+HEALTHCHECK_AFTER = float(os.environ.get('DB_HEALTHCHECK_AFTER', '30'))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class TracedCursor(psycopg2.extensions.cursor):
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        with tracing.span('db.query'):
+            return super().execute(query, vars)
+
+
+class TracedConnection(psycopg2.extensions.connection):
+    '''
+    Business: Соединение, которое пишет спаны db.query и db.commit в trace текущего вызова
+    '''
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = TracedCursor
+
+    def commit(self) -> None:
+        if self.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return super().commit()
+        with tracing.span('db.commit'):
+            super().commit()
+
+
+class ConnectionPool:
+    '''
+    Business: Ограниченный пул соединений с PostgreSQL, переживающий тёплые вызовы
+    Args: dsn, максимальный размер пула, таймаут ожидания свободного соединения
+    '''
+
+    def __init__(self, dsn: str, max_size: int, timeout: float, healthcheck_after: float) -> None:
+        self.dsn = dsn
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+        self._idle: List[Tuple[Any, float]] = []
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._stats: Dict[str, int] = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'connects': 0,
+            'reconnects': 0,
+            'discarded': 0,
+        }
+
+    def _connect(self) -> Any:
+        with tracing.span('db.connect'):
+            conn = psycopg2.connect(
+                self.dsn,
+                connect_timeout=CONNECT_TIMEOUT,
+                connection_factory=TracedConnection if tracing.ENABLED else None,
+            )
+        self._stats['connects'] += 1
+        return conn
+
+    def _is_healthy(self, conn: Any, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.healthcheck_after:
+            return True
+        try:
+            with tracing.span('db.ping'), conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self) -> Any:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, idle_since = self._idle.pop()
+            if self._is_healthy(conn, idle_since):
+                return conn
+            self._close(conn)
+            self._stats['reconnects'] += 1
+        return self._connect()
+
+    def _close(self, conn: Any) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _checkin(self, conn: Any, broken: bool) -> None:
+        if not broken and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if broken or conn.closed:
+            self._close(conn)
+            self._stats['discarded'] += 1
+            return
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        if not self._slots.acquire(blocking=False):
+            self._stats['waits'] += 1
+            with tracing.span('db.pool_wait'):
+                acquired = self._slots.acquire(timeout=self.timeout)
+            if not acquired:
+                self._stats['timeouts'] += 1
+                raise PoolTimeout('No free database connection')
+        conn = None
+        broken = False
+        try:
+            conn = self._checkout()
+            self._stats['checkouts'] += 1
+            self._in_use += 1
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if conn is not None:
+                self._in_use -= 1
+                self._checkin(conn, broken)
+            self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            idle = len(self._idle)
+        return {**self._stats, 'idle': idle, 'in_use': self._in_use, 'max_size': self.max_size}
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    os.environ.get('DATABASE_URL', ''),
+                    POOL_MAX_SIZE,
+                    POOL_TIMEOUT,
+                    HEALTHCHECK_AFTER,
+                )
+    return _pool
+
+
+def connection() -> Any:
+    '''
+    Business: Берёт соединение из пула и гарантированно возвращает его на любом пути
+    Returns: контекстный менеджер с psycopg2-соединением
+    '''
+    return get_pool().connection()
+
+
+def pool_stats() -> Dict[str, int]:
+    return get_pool().stats()
+
+
+tracing.register('db_pool', pool_stats)
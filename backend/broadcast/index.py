@@ -0,0 +1,363 @@
+import os
+import json
+import hmac
+import threading
+import time
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+from db import connection
+from runtime import HttpError, Router, header, json_response, parse_json_body, query_params
+from telegram_api import CONNECT_TIMEOUT, READ_TIMEOUT, BotApiClient, BotApiError, RateLimiter, get_client
+import tracing
+
+CHUNK_SIZE = int(os.environ.get('BROADCAST_CHUNK_SIZE', '200'))
+CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', '4'))
+MAX_RETRIES = int(os.environ.get('BROADCAST_MAX_RETRIES', '3'))
+LEASE_SECONDS = int(os.environ.get('BROADCAST_LEASE_SECONDS', '60'))
+TIME_BUDGET = float(os.environ.get('BROADCAST_TIME_BUDGET', '25'))
+GLOBAL_RATE = float(os.environ.get('BROADCAST_GLOBAL_RATE', '25'))
+PER_CHAT_INTERVAL = 1.0
+MAX_TEXT_LENGTH = 4096
+PARSE_MODES = frozenset({'HTML', 'Markdown', 'MarkdownV2'})
+SEND_RESERVE = CONNECT_TIMEOUT + READ_TIMEOUT
+DEFERRED = 'deferred'
+
+if LEASE_SECONDS < TIME_BUDGET + 2 * SEND_RESERVE:
+    raise ValueError('BROADCAST_LEASE_SECONDS must exceed BROADCAST_TIME_BUDGET plus two worst-case sends')
+
+CREATE_JOB_SQL = '''
+    INSERT INTO broadcast_jobs (payload, recipients)
+    SELECT %s, COUNT(*) FROM users
+    RETURNING id, recipients
+'''
+
+CLAIM_JOB_SQL = '''
+    UPDATE broadcast_jobs
+    SET status = 'running', started_at = COALESCE(started_at, CURRENT_TIMESTAMP),
+        lease_until = CURRENT_TIMESTAMP + make_interval(secs => %(lease)s), updated_at = CURRENT_TIMESTAMP
+    WHERE id = (
+        SELECT id FROM broadcast_jobs
+        WHERE status IN ('pending', 'running')
+            AND (lease_until IS NULL OR lease_until <= CURRENT_TIMESTAMP)
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, payload, last_telegram_id, deferred, lease_until
+'''
+
+RECIPIENTS_SQL = '''
+    SELECT telegram_id FROM users
+    WHERE telegram_id > %s
+    ORDER BY telegram_id
+'''
+
+CHECKPOINT_SQL = '''
+    UPDATE broadcast_jobs
+    SET last_telegram_id = GREATEST(last_telegram_id, %(last_telegram_id)s),
+        sent = sent + %(sent)s,
+        failed = failed + %(failed)s,
+        failures = (
+            SELECT COALESCE(jsonb_object_agg(key, total), '{}')
+            FROM (
+                SELECT key, SUM(value::integer) AS total
+                FROM (
+                    SELECT * FROM jsonb_each_text(failures)
+                    UNION ALL
+                    SELECT * FROM jsonb_each_text(%(failures)s::jsonb)
+                ) f
+                GROUP BY key
+            ) t
+        ),
+        send_seconds = send_seconds + %(seconds)s,
+        deferred = %(deferred)s::bigint[],
+        status = %(status)s,
+        finished_at = CASE WHEN %(status)s = 'completed' THEN CURRENT_TIMESTAMP END,
+        lease_until = CURRENT_TIMESTAMP + make_interval(secs => %(lease)s),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id = %(job_id)s AND status = 'running' AND lease_until = %(lease_until)s
+    RETURNING lease_until
+'''
+
+JOB_COLUMNS = (
+    'id', 'status', 'recipients', 'sent', 'failed', 'failures', 'send_seconds',
+    'last_telegram_id', 'created_at', 'started_at', 'finished_at',
+)
+
+JOBS_SQL = f'''
+    SELECT {', '.join(JOB_COLUMNS)}
+    FROM broadcast_jobs
+    WHERE %(job_id)s::bigint IS NULL OR id = %(job_id)s
+    ORDER BY id DESC
+    LIMIT 20
+'''
+
+router = Router(allow_headers='Content-Type, X-Admin-Token')
+limiter = RateLimiter(GLOBAL_RATE, PER_CHAT_INTERVAL)
+
+
+def prepare(payload: Dict[str, Any]) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def render(template: bytes, chat_id: int) -> bytes:
+    return b'{"chat_id":%d,%s' % (int(chat_id), template[1:])
+
+
+def deliver(client: BotApiClient, template: bytes, chat_id: int, deadline: float) -> Optional[str]:
+    '''
+    Business: Отправка одному получателю с повтором после 429 и сетевых ошибок; не ждёт слота, который
+              наступит позже deadline - SEND_RESERVE
+    Returns: None при успехе, DEFERRED - отложен до следующего запуска, иначе причина отказа для сводки
+    '''
+    reason = None
+    for _ in range(MAX_RETRIES + 1):
+        if not limiter.wait(chat_id, deadline - SEND_RESERVE):
+            return DEFERRED
+        try:
+            client.call('sendMessage', render(template, chat_id))
+            return None
+        except BotApiError as e:
+            if e.status == 429:
+                limiter.pause(e.retry_after or 1.0)
+                reason = 'rate_limited'
+            elif e.status == 0:
+                reason = 'network'
+            elif e.status >= 500:
+                reason = 'server_error'
+            elif e.status == 403:
+                return 'blocked'
+            elif e.status == 400:
+                return 'bad_request'
+            else:
+                return f'http_{e.status}'
+    return reason
+
+
+def send_chunk(client: BotApiClient, template: bytes, chat_ids: List[int],
+               deadline: float) -> Tuple[int, Counter, List[int]]:
+    '''
+    Business: Параллельная отправка пачки получателей ограниченным числом потоков
+    Args: клиент Bot API, шаблон сообщения, telegram_id по возрастанию, крайний срок
+    Returns: сколько первых получателей пачки обработано, причины отказов и отложенные получатели
+    '''
+    failures: Counter = Counter()
+    deferred: List[int] = []
+    lock = threading.Lock()
+    cursor = [0]
+
+    def worker() -> None:
+        while True:
+            with lock:
+                index = cursor[0]
+                if index >= len(chat_ids) or deferred or time.monotonic() + SEND_RESERVE >= deadline:
+                    return
+                cursor[0] += 1
+            reason = deliver(client, template, chat_ids[index], deadline)
+            if reason == DEFERRED:
+                with lock:
+                    deferred.append(chat_ids[index])
+            elif reason:
+                with lock:
+                    failures[reason] += 1
+
+    threads = [threading.Thread(target=tracing.bind(worker)) for _ in range(min(CONCURRENCY, len(chat_ids)) - 1)]
+    for thread in threads:
+        thread.start()
+    worker()
+    for thread in threads:
+        thread.join()
+    return cursor[0], failures, sorted(deferred)
+
+
+def checkpoint(job_id: int, lease_until: Any, last_telegram_id: int, sent: int, failures: Counter,
+               seconds: float, deferred: List[int], status: str, lease: int) -> Any:
+    '''
+    Business: Сохраняет прогресс рассылки, только пока аренда задания принадлежит этому запуску
+    Args: задание и его lease_until из захвата или прошлой отметки, прогресс пачки, отложенные получатели,
+          статус, продление аренды в секундах
+    Returns: новый lease_until или None, если задание уже перехватил другой запуск
+    '''
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CHECKPOINT_SQL, {
+                'job_id': job_id,
+                'lease_until': lease_until,
+                'last_telegram_id': last_telegram_id,
+                'sent': sent,
+                'failed': sum(failures.values()),
+                'failures': json.dumps(failures),
+                'seconds': seconds,
+                'deferred': deferred,
+                'status': status,
+                'lease': lease,
+            })
+            row = cur.fetchone()
+        conn.commit()
+    return row[0] if row else None
+
+
+def run_job(client: BotApiClient, job_id: int, payload: Dict[str, Any], last_telegram_id: int,
+            deferred: List[int], lease_until: Any, deadline: float) -> Dict[str, Any]:
+    '''
+    Business: Отправляет рассылку пачками до крайнего срока, сохраняя прогресс после каждой пачки; сначала
+              досылает получателей, отложенных прошлым запуском; останавливается, если аренду перехватили
+    Args: клиент Bot API, задание, последний обработанный telegram_id, отложенные получатели,
+          lease_until из захвата, крайний срок
+    Returns: статистика отправки за этот запуск
+    '''
+    template = prepare(payload)
+    stats: Dict[str, Any] = {'job_id': job_id, 'sent': 0, 'failed': 0, 'failures': Counter(), 'seconds': 0.0}
+    status = 'running'
+    pending = list(deferred)
+
+    def process(chat_ids: List[int], retrying: bool) -> bool:
+        nonlocal lease_until, pending
+        started = time.monotonic()
+        processed, failures, deferred_now = send_chunk(client, template, chat_ids, deadline)
+        seconds = time.monotonic() - started
+        if not processed:
+            return True
+        sent = processed - sum(failures.values()) - len(deferred_now)
+        if retrying:
+            pending = sorted(deferred_now + chat_ids[processed:])
+        else:
+            pending = sorted(pending + deferred_now)
+        lease_until = checkpoint(job_id, lease_until, 0 if retrying else chat_ids[processed - 1],
+                                 sent, failures, seconds, pending, status, LEASE_SECONDS)
+        stats['sent'] += sent
+        stats['failed'] += sum(failures.values())
+        stats['failures'].update(failures)
+        stats['seconds'] += seconds
+        return lease_until is not None
+
+    owned = True
+    if pending and time.monotonic() + SEND_RESERVE < deadline:
+        owned = process(list(pending), True)
+
+    with connection() as conn:
+        with conn.cursor(name=f'broadcast_{job_id}') as cur:
+            cur.itersize = CHUNK_SIZE
+            cur.execute(RECIPIENTS_SQL, (last_telegram_id,))
+            while owned and time.monotonic() + SEND_RESERVE < deadline:
+                chat_ids = [row[0] for row in cur.fetchmany(CHUNK_SIZE)]
+                if not chat_ids:
+                    status = 'running' if pending else 'completed'
+                    break
+                owned = process(chat_ids, False)
+        conn.rollback()
+
+    if owned:
+        checkpoint(job_id, lease_until, 0, 0, Counter(), 0.0, pending, status, 0)
+    stats['status'] = status if owned else 'lease_lost'
+    stats['deferred'] = len(pending)
+    return stats
+
+
+def job_report(row: Tuple) -> Dict[str, Any]:
+    job = dict(zip(JOB_COLUMNS, row))
+    seconds = job.pop('send_seconds')
+    job['msgs_per_second'] = round(job['sent'] / seconds, 2) if seconds else 0.0
+    job['progress'] = round((job['sent'] + job['failed']) / job['recipients'], 4) if job['recipients'] else 1.0
+    return job
+
+
+def require_admin(event: Dict[str, Any]) -> None:
+    admin_token = os.environ.get('BROADCAST_ADMIN_TOKEN', '')
+    if not admin_token:
+        raise HttpError(403, 'Broadcast admin token is not configured')
+    if not hmac.compare_digest(header(event, 'X-Admin-Token').encode('utf-8'), admin_token.encode('utf-8')):
+        raise HttpError(403, 'Forbidden')
+
+
+def parse_payload(body_data: Dict[str, Any]) -> Dict[str, Any]:
+    text = body_data.get('text')
+    if not isinstance(text, str) or not text.strip() or len(text) > MAX_TEXT_LENGTH:
+        raise HttpError(400, f'text is required and must be at most {MAX_TEXT_LENGTH} characters')
+    payload: Dict[str, Any] = {'text': text}
+    parse_mode = body_data.get('parse_mode')
+    if parse_mode is not None:
+        if parse_mode not in PARSE_MODES:
+            raise HttpError(400, 'parse_mode is not supported')
+        payload['parse_mode'] = parse_mode
+    reply_markup = body_data.get('reply_markup')
+    if reply_markup is not None:
+        if not isinstance(reply_markup, dict):
+            raise HttpError(400, 'reply_markup must be an object')
+        payload['reply_markup'] = reply_markup
+    return payload
+
+
+def create_job(event: Dict[str, Any], body_data: Dict[str, Any]) -> Dict[str, Any]:
+    require_admin(event)
+    payload = parse_payload(body_data)
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CREATE_JOB_SQL, (json.dumps(payload, ensure_ascii=False),))
+            job_id, recipients = cur.fetchone()
+        conn.commit()
+    return json_response(200, {'job_id': job_id, 'recipients': recipients, 'status': 'pending'})
+
+
+@router.route('POST')
+def broadcast(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    body_data = parse_json_body(event)
+    if 'text' in body_data:
+        return create_job(event, body_data)
+
+    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+    if not bot_token:
+        raise HttpError(500, 'TELEGRAM_BOT_TOKEN is not configured')
+    client = get_client(bot_token)
+
+    started = time.monotonic()
+    deadline = started + TIME_BUDGET
+    runs = []
+    while time.monotonic() + SEND_RESERVE < deadline:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(CLAIM_JOB_SQL, {'lease': LEASE_SECONDS})
+                job = cur.fetchone()
+            conn.commit()
+        if not job:
+            break
+        run = run_job(client, *job, deadline)
+        runs.append(run)
+        if run['status'] != 'completed' and not run['sent'] + run['failed']:
+            break
+
+    for run in runs:
+        seconds = run.pop('seconds')
+        run['msgs_per_second'] = round(run['sent'] / seconds, 2) if seconds else 0.0
+
+    return json_response(200, {
+        'jobs': runs,
+        'duration': round(time.monotonic() - started, 3),
+        'api': client.stats()
+    })
+
+
+@router.route('GET')
+def get_jobs(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    require_admin(event)
+    job_id = query_params(event).get('job_id')
+    if job_id is not None and not job_id.isdigit():
+        raise HttpError(400, 'job_id must be a number')
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(JOBS_SQL, {'job_id': int(job_id) if job_id else None})
+            rows = cur.fetchall()
+        conn.rollback()
+    if job_id and not rows:
+        raise HttpError(404, 'Broadcast job not found')
+    return json_response(200, {'jobs': [job_report(row) for row in rows]})
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Массовая рассылка сообщения всем пользователям бота с возобновлением после сбоя
+    Args: event - POST с text (создать рассылку, нужен X-Admin-Token), POST без тела или таймер (отправка), GET (отчёт)
+    Returns: HTTP response с номером рассылки или статистикой: отправлено, ошибки по причинам, сообщений в секунду
+    '''
+    return router.dispatch(event, context)
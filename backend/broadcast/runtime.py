@@ -0,0 +1,161 @@
+import os
+import hmac
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Any, Callable, Optional
+
+orjson = None
+if os.environ.get('RESPONSE_JSON') == 'orjson':
+    try:
+        import orjson
+    except ImportError:
+        pass
+
+import psycopg2
+
+import tracing
+from db import PoolTimeout
+
+Handler = Callable[[Dict[str, Any], Any], Dict[str, Any]]
+
+FUNCTION_NAME = os.environ.get('FUNCTION_NAME') or os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+JSON_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*'
+}
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(value: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(value, default=_default).decode('utf-8')
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+class HttpError(Exception):
+    '''
+    Business: Ошибка, которую роутер превращает в JSON-ответ с нужным статусом
+    Args: HTTP-статус, текст ошибки, дополнительные заголовки, дополнительные поля тела ответа
+    '''
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None, **extra: Any) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers
+        self.extra = extra
+
+
+def json_response(status: int, body: Any, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': headers or JSON_HEADERS,
+        'isBase64Encoded': False,
+        'body': dumps(body)
+    }
+
+
+def error_response(status: int, message: str, **extra: Any) -> Dict[str, Any]:
+    return json_response(status, {'error': message, **extra})
+
+
+def parse_json_body(event: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except ValueError:
+        raise HttpError(400, 'Invalid JSON body')
+    if not isinstance(body, dict):
+        raise HttpError(400, 'JSON body must be an object')
+    return body
+
+
+def query_params(event: Dict[str, Any]) -> Dict[str, str]:
+    return event.get('queryStringParameters') or {}
+
+
+def header(event: Dict[str, Any], name: str) -> str:
+    headers = event.get('headers') or {}
+    value = headers.get(name)
+    if value is None:
+        name = name.lower()
+        value = next((v for k, v in headers.items() if k.lower() == name), '')
+    return value or ''
+
+
+class Router:
+    '''
+    Business: Маршрутизация по httpMethod с общими CORS-заголовками и обработкой ошибок
+    Args: метод по умолчанию (для вызовов по таймеру), разрешённые заголовки CORS
+    '''
+
+    def __init__(self, default_method: str = 'POST', allow_headers: str = 'Content-Type, X-User-Id, X-Telegram-Init-Data') -> None:
+        self.default_method = default_method
+        self.allow_headers = allow_headers
+        self.routes: Dict[str, Handler] = {}
+        self._options_response: Optional[Dict[str, Any]] = None
+        self._not_allowed = error_response(405, 'Method not allowed')
+
+    def route(self, method: str) -> Callable[[Handler], Handler]:
+        def register(func: Handler) -> Handler:
+            self.routes[method] = func
+            self._options_response = None
+            return func
+        return register
+
+    def options_response(self) -> Dict[str, Any]:
+        if self._options_response is None:
+            self._options_response = {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': ', '.join([*self.routes, 'OPTIONS']),
+                    'Access-Control-Allow-Headers': self.allow_headers,
+                    'Access-Control-Max-Age': '86400'
+                },
+                'body': '',
+                'isBase64Encoded': False
+            }
+        return self._options_response
+
+    def metrics_response(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        if not hmac.compare_digest(header(event, 'X-Metrics-Token').encode('utf-8'), METRICS_TOKEN.encode('utf-8')):
+            return error_response(403, 'Forbidden')
+        return json_response(200, tracing.metrics())
+
+    def dispatch(self, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        method = event.get('httpMethod') or self.default_method
+        if method == 'OPTIONS':
+            return self.options_response()
+        if METRICS_TOKEN and header(event, 'X-Metrics-Token'):
+            return self.metrics_response(event)
+        func = self.routes.get(method)
+        if func is None:
+            return self._not_allowed
+
+        trace = tracing.begin()
+        request_id = getattr(context, 'request_id', None) or os.urandom(8).hex()
+        error: Optional[BaseException] = None
+        try:
+            response = func(event, context)
+        except HttpError as e:
+            headers = {**JSON_HEADERS, **e.headers} if e.headers else None
+            response = json_response(e.status, {'error': e.message, **e.extra}, headers)
+        except (PoolTimeout, psycopg2.OperationalError) as e:
+            error = e
+            response = error_response(503, 'Service temporarily unavailable',
+                                      error_class=type(e).__name__, request_id=request_id)
+        except Exception as e:
+            error = e
+            response = error_response(500, 'Internal error', error_class=type(e).__name__, request_id=request_id)
+        tracing.finish(trace, FUNCTION_NAME, method, response['statusCode'], request_id, error)
+        return response
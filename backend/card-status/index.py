@@ -0,0 +1,235 @@
+import os
+import re
+import hmac
+from typing import Dict, Any, Iterator, List, Tuple
+
+from db import connection
+from ledger import posting_ctes
+from runtime import HttpError, Router, header, json_response, parse_json_body, query_params
+from telegram_auth import authenticate
+
+CARD_STATUSES = ['none', 'ordered', 'issued', 'activated']
+BANK_STATUSES = frozenset(CARD_STATUSES[1:])
+CARD_BONUS = 500
+REFERRAL_BONUS = 200
+BULK_BATCH_SIZE = int(os.environ.get('CARD_STATUS_BATCH_SIZE', '5000'))
+BULK_MAX_UPDATES = int(os.environ.get('CARD_STATUS_MAX_UPDATES', '50000'))
+HISTORY_LIMIT = 20
+
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9_:.-]{1,128}$')
+
+TRANSITION_CTES = '''
+    WITH input AS (
+        SELECT * FROM unnest(%(keys)s::text[], %(telegram_ids)s::bigint[], %(statuses)s::text[])
+            AS i(idempotency_key, telegram_id, to_status)
+    ), locked AS (
+        SELECT telegram_id, card_status FROM users
+        WHERE telegram_id = ANY(%(telegram_ids)s::bigint[])
+        ORDER BY telegram_id
+        FOR UPDATE
+    ), events AS (
+        INSERT INTO card_status_events (idempotency_key, telegram_id, from_status, to_status, source, applied)
+        SELECT i.idempotency_key, i.telegram_id, l.card_status, i.to_status, %(source)s,
+            array_position(%(order)s::text[], i.to_status) > array_position(%(order)s::text[], l.card_status)
+        FROM input i
+        JOIN locked l ON l.telegram_id = i.telegram_id
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING telegram_id, to_status, applied
+    ), moved AS (
+        UPDATE users u
+        SET card_status = e.to_status,
+            card_ordered = TRUE,
+            card_activated = (e.to_status = 'activated'),
+            updated_at = CURRENT_TIMESTAMP
+        FROM events e
+        WHERE u.telegram_id = e.telegram_id AND e.applied
+        RETURNING u.telegram_id, e.to_status, pg_notify('users_changed', u.telegram_id::text)
+    )
+'''
+
+ORDER_SQL = TRANSITION_CTES + '''
+    SELECT l.card_status, EXISTS (SELECT 1 FROM moved)
+    FROM locked l
+'''
+
+BULK_SQL = TRANSITION_CTES + '''
+    SELECT
+        (SELECT COUNT(*) FROM locked),
+        (SELECT COUNT(*) FROM events),
+        (SELECT COUNT(*) FROM moved),
+        (SELECT COALESCE(array_agg(telegram_id), '{}') FROM moved WHERE to_status = 'activated')
+'''
+
+ACTIVATION_BONUS_SQL = '''
+    WITH activated AS (
+        SELECT telegram_id, referred_by
+        FROM users
+        WHERE telegram_id = ANY(%(telegram_ids)s::bigint[])
+    ),''' + posting_ctes('''
+        SELECT telegram_id, %(bonus)s::numeric, 'card_bonus', 'card_bonus:' || telegram_id
+        FROM activated
+        UNION ALL
+        SELECT a.referred_by, %(referral_bonus)s::numeric, 'referral_bonus', 'referral_bonus:' || a.telegram_id
+        FROM activated a
+        JOIN users r ON r.telegram_id = a.referred_by AND r.telegram_id <> a.telegram_id
+    ''') + ''', queued AS (
+        INSERT INTO notification_outbox (chat_id, kind, params)
+        SELECT telegram_id, CASE kind WHEN 'card_bonus' THEN 'card_activated' ELSE kind END,
+            jsonb_build_object('balance', balance)
+        FROM credited, unnest(kinds) AS kind
+    )
+    SELECT COUNT(*) FILTER (WHERE 'card_bonus' = ANY(kinds)) FROM credited
+'''
+
+STATUS_SQL = '''
+    SELECT u.card_status, COALESCE(
+        (SELECT jsonb_agg(jsonb_build_object(
+                    'from', e.from_status, 'to', e.to_status, 'source', e.source,
+                    'applied', e.applied, 'at', e.created_at
+                ) ORDER BY e.created_at DESC)
+         FROM (
+             SELECT * FROM card_status_events
+             WHERE telegram_id = u.telegram_id
+             ORDER BY created_at DESC
+             LIMIT %(limit)s
+         ) e),
+        '[]'::jsonb)
+    FROM users u
+    WHERE u.telegram_id = %(telegram_id)s
+'''
+
+router = Router(allow_headers='Content-Type, X-Telegram-Init-Data, X-Bank-Token')
+
+
+def transition_params(batch: List[Tuple[str, int, str]], source: str) -> Dict[str, Any]:
+    return {
+        'keys': [key for key, _, _ in batch],
+        'telegram_ids': [telegram_id for _, telegram_id, _ in batch],
+        'statuses': [status for _, _, status in batch],
+        'source': source,
+        'order': CARD_STATUSES,
+    }
+
+
+def batches(updates: List[Tuple[str, int, str]], size: int) -> Iterator[List[Tuple[str, int, str]]]:
+    '''
+    Business: Делит обновления на пачки, в которых каждый пользователь встречается один раз, сохраняя порядок
+    '''
+    batch: List[Tuple[str, int, str]] = []
+    users = set()
+    for update in updates:
+        if len(batch) >= size or update[1] in users:
+            yield batch
+            batch, users = [], set()
+        batch.append(update)
+        users.add(update[1])
+    if batch:
+        yield batch
+
+
+def parse_updates(body_data: Dict[str, Any]) -> List[Tuple[str, int, str]]:
+    updates = body_data.get('updates')
+    if not isinstance(updates, list) or not updates:
+        raise HttpError(400, 'updates must be a non-empty array')
+    if len(updates) > BULK_MAX_UPDATES:
+        raise HttpError(400, f'At most {BULK_MAX_UPDATES} updates per request')
+    parsed = []
+    for index, update in enumerate(updates):
+        if not isinstance(update, dict):
+            raise HttpError(400, 'update must be an object', index=index)
+        telegram_id = update.get('telegram_id')
+        event_id = str(update.get('event_id', ''))
+        if not isinstance(telegram_id, int) or isinstance(telegram_id, bool) or telegram_id <= 0:
+            raise HttpError(400, 'telegram_id must be a positive integer', index=index)
+        if update.get('status') not in BANK_STATUSES:
+            raise HttpError(400, f"status must be one of: {', '.join(CARD_STATUSES[1:])}", index=index)
+        if not REQUEST_ID_RE.match(event_id):
+            raise HttpError(400, 'event_id is required', index=index)
+        parsed.append((f'bank:{event_id}', telegram_id, update['status']))
+    return parsed
+
+
+def apply_bank_updates(event: Dict[str, Any], body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Business: Статусы карт от банка-партнёра пачками по BULK_BATCH_SIZE - одна транзакция и два запроса на пачку
+    Args: event с X-Bank-Token, тело {"updates": [{"telegram_id", "status", "event_id"}]}
+    Returns: сколько статусов применено, повторов, отклонённых переходов, неизвестных пользователей
+    '''
+    bank_token = os.environ.get('CARD_BANK_TOKEN', '')
+    if not bank_token:
+        raise HttpError(403, 'Bank token is not configured')
+    if not hmac.compare_digest(header(event, 'X-Bank-Token').encode('utf-8'), bank_token.encode('utf-8')):
+        raise HttpError(403, 'Forbidden')
+    updates = parse_updates(body_data)
+
+    stats = {'received': len(updates), 'applied': 0, 'duplicates': 0, 'rejected': 0,
+             'unknown_users': 0, 'activated': 0, 'batches': 0}
+    with connection() as conn:
+        for batch in batches(updates, BULK_BATCH_SIZE):
+            with conn.cursor() as cur:
+                cur.execute(BULK_SQL, transition_params(batch, 'bank'))
+                found, recorded, applied, activated = cur.fetchone()
+                if activated:
+                    cur.execute(ACTIVATION_BONUS_SQL, {
+                        'telegram_ids': activated,
+                        'bonus': CARD_BONUS,
+                        'referral_bonus': REFERRAL_BONUS,
+                    })
+                    stats['activated'] += cur.fetchone()[0]
+            conn.commit()
+            stats['batches'] += 1
+            stats['applied'] += applied
+            stats['duplicates'] += found - recorded
+            stats['rejected'] += recorded - applied
+            stats['unknown_users'] += len(batch) - found
+    return json_response(200, stats)
+
+
+@router.route('POST')
+def change_status(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    body_data = parse_json_body(event)
+    if 'updates' in body_data:
+        return apply_bank_updates(event, body_data)
+
+    telegram_id = authenticate(event, body_data.get('telegram_id'))['telegram_id']
+    request_id = str(body_data.get('request_id', ''))
+    if request_id and not REQUEST_ID_RE.match(request_id):
+        raise HttpError(400, 'request_id is invalid')
+    key = f'order:{telegram_id}:{request_id}' if request_id else f'order:{telegram_id}'
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(ORDER_SQL, transition_params([(key, telegram_id, 'ordered')], 'user'))
+            result = cur.fetchone()
+        conn.commit()
+
+    if not result:
+        raise HttpError(404, 'User not found')
+    card_status, changed = result
+    return json_response(200, {
+        'card_status': 'ordered' if changed else card_status,
+        'changed': changed,
+    })
+
+
+@router.route('GET')
+def get_status(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    telegram_id = authenticate(event, query_params(event).get('telegram_id'))['telegram_id']
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(STATUS_SQL, {'telegram_id': telegram_id, 'limit': HISTORY_LIMIT})
+            result = cur.fetchone()
+        conn.rollback()
+    if not result:
+        raise HttpError(404, 'User not found')
+    return json_response(200, {'card_status': result[0], 'history': result[1]})
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Статус карты пользователя: none -> ordered -> issued -> activated, только вперёд
+    Args: event - POST с X-Telegram-Init-Data (пользователь заказал карту, request_id - ключ идемпотентности),
+          POST с X-Bank-Token и updates (статусы от банка пачками), GET (статус и история)
+    Returns: HTTP response со статусом карты или статистикой применения пачки
+    '''
+    return router.dispatch(event, context)
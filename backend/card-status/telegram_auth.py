@@ -0,0 +1,111 @@
+import os
+import json
+import hmac
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from runtime import HttpError, header
+import tracing
+
+INIT_DATA_HEADER = 'X-Telegram-Init-Data'
+INIT_DATA_MAX_AGE = int(os.environ.get('TELEGRAM_INIT_DATA_MAX_AGE', '86400'))
+CLAIMS_CACHE_SIZE = int(os.environ.get('TELEGRAM_INIT_DATA_CACHE_SIZE', '10000'))
+ALLOW_UNSIGNED = os.environ.get('ALLOW_UNSIGNED_TELEGRAM_ID') == '1'
+
+_secrets: Dict[str, bytes] = {}
+_claims: 'OrderedDict[bytes, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+_lock = threading.Lock()
+_stats = {'verified': 0, 'cache_hits': 0, 'rejected': 0, 'unsigned': 0}
+
+
+def secret_key(bot_token: str) -> bytes:
+    '''
+    Business: Ключ проверки initData - HMAC-SHA256("WebAppData", токен бота), считается один раз на инстанс
+    '''
+    key = _secrets.get(bot_token)
+    if key is None:
+        key = _secrets[bot_token] = hmac.new(b'WebAppData', bot_token.encode('utf-8'), hashlib.sha256).digest()
+    return key
+
+
+def _reject(message: str) -> HttpError:
+    with _lock:
+        _stats['rejected'] += 1
+    return HttpError(401, message)
+
+
+def verify_init_data(init_data: str, bot_token: str) -> Dict[str, Any]:
+    '''
+    Business: Проверка подписи initData Telegram Mini App
+    Args: строка initData из Telegram.WebApp, токен бота
+    Returns: telegram_id, first_name, username, start_param; при ошибке HttpError 401
+    '''
+    digest = hashlib.sha256(init_data.encode('utf-8')).digest()
+    now = time.time()
+    with _lock:
+        cached = _claims.get(digest)
+        if cached is not None and cached[0] > now:
+            _claims.move_to_end(digest)
+            _stats['cache_hits'] += 1
+            return cached[1]
+
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received_hash = fields.pop('hash', '')
+    data_check_string = '\n'.join(f'{k}={fields[k]}' for k in sorted(fields))
+    expected_hash = hmac.new(secret_key(bot_token), data_check_string.encode('utf-8'), hashlib.sha256).hexdigest()
+    if not received_hash or not hmac.compare_digest(expected_hash, received_hash):
+        raise _reject('Invalid initData signature')
+
+    try:
+        auth_date = int(fields.get('auth_date', '0'))
+        user = json.loads(fields.get('user', '{}'))
+        telegram_id = int(user['id'])
+    except (ValueError, KeyError, TypeError):
+        raise _reject('Invalid initData user')
+    expires_at = auth_date + INIT_DATA_MAX_AGE
+    if expires_at <= now:
+        raise _reject('initData expired')
+
+    claims = {
+        'telegram_id': telegram_id,
+        'first_name': user.get('first_name') or '',
+        'username': user.get('username') or '',
+        'start_param': fields.get('start_param') or '',
+    }
+    with _lock:
+        _stats['verified'] += 1
+        _claims[digest] = (expires_at, claims)
+        if len(_claims) > CLAIMS_CACHE_SIZE:
+            _claims.popitem(last=False)
+    return claims
+
+
+def authenticate(event: Dict[str, Any], telegram_id: Optional[Any] = None) -> Dict[str, Any]:
+    '''
+    Business: Пользователь запроса по заголовку X-Telegram-Init-Data, до любой работы с базой
+    Args: event, telegram_id из запроса - используется только при ALLOW_UNSIGNED_TELEGRAM_ID=1 (разработка)
+    Returns: проверенные данные пользователя
+    '''
+    init_data = header(event, INIT_DATA_HEADER)
+    if init_data:
+        bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+        if not bot_token:
+            raise HttpError(500, 'TELEGRAM_BOT_TOKEN is not configured')
+        return verify_init_data(init_data, bot_token)
+    if ALLOW_UNSIGNED and telegram_id is not None and str(telegram_id).isdigit():
+        with _lock:
+            _stats['unsigned'] += 1
+        return {'telegram_id': int(telegram_id), 'first_name': '', 'username': '', 'start_param': '', 'unsigned': True}
+    raise _reject('Telegram initData is required')
+
+
+def auth_stats() -> Dict[str, Any]:
+    with _lock:
+        return {**_stats, 'cached_claims': len(_claims)}
+
+
+tracing.register('telegram_auth', auth_stats)
@@ -0,0 +1,141 @@
+'''
+Business: Потоковая выгрузка воронки в CSV/Parquet частями по месяцам через серверный курсор
+Args: --database-url (лучше реплика), --source funnel|users, --since, --until, --out, --format csv|parquet,
+      --chunk-rows
+Returns: файлы <out>/<source>/month=YYYY-MM/part-00000.<format>, список путей в stdout
+
+users - построчная выгрузка без персональных данных (день регистрации и шаги воронки),
+для своих разрезов в аналитике; funnel - готовая дневная сводка funnel_daily.
+'''
+import argparse
+import csv
+import io
+import os
+import sys
+from datetime import date
+from typing import Any, Iterator, List, Sequence, Tuple
+
+import psycopg2
+
+CHUNK_ROWS = int(os.environ.get('FUNNEL_EXPORT_CHUNK_ROWS', '50000'))
+
+FUNNEL_COLUMNS = ('day', 'joined', 'card_ordered', 'card_activated', 'referred', 'referrers')
+
+SOURCES = {
+    'funnel': (FUNNEL_COLUMNS, f'''
+        SELECT {', '.join(FUNNEL_COLUMNS)}
+        FROM funnel_daily
+        WHERE day >= %(since)s AND day < %(until)s
+        ORDER BY day
+    '''),
+    'users': (('day', 'card_ordered', 'card_activated', 'referred', 'referral_count'), '''
+        SELECT created_at::date, card_ordered IS TRUE, card_activated IS TRUE,
+            referred_by IS NOT NULL, referral_count
+        FROM users
+        WHERE created_at >= %(since)s AND created_at < %(until)s
+        ORDER BY created_at
+    '''),
+}
+
+
+def stream_rows(conn: Any, sql: str, params: Any, chunk_rows: int = CHUNK_ROWS) -> Iterator[List[Tuple]]:
+    '''
+    Business: Читает результат запроса пачками через именованный (серверный) курсор, не загружая его целиком
+    Args: соединение, запрос, параметры, строк в пачке
+    Returns: итератор пачек строк
+    '''
+    with conn.cursor(name='funnel_export') as cur:
+        cur.itersize = chunk_rows
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield rows
+
+
+def to_csv(columns: Sequence[str], rows: List[Tuple], header: bool = True) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(columns)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def write_part(path: str, columns: Sequence[str], rows: List[Tuple], file_format: str) -> None:
+    if file_format == 'parquet':
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError('pyarrow is required for --format parquet')
+        table = pyarrow.table({name: [row[i] for row in rows] for i, name in enumerate(columns)})
+        pyarrow.parquet.write_table(table, path)
+        return
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(to_csv(columns, rows))
+
+
+def export(conn: Any, source: str, since: date, until: date, out_dir: str,
+           file_format: str = 'csv', chunk_rows: int = CHUNK_ROWS) -> List[str]:
+    '''
+    Business: Выгрузка источника в файлы, разбитые по месяцам и не длиннее chunk_rows строк
+    Args: соединение, funnel или users, период [since, until), каталог, csv или parquet, строк в файле
+    Returns: пути записанных файлов
+    '''
+    columns, sql = SOURCES[source]
+    paths: List[str] = []
+    parts = {}
+    pending: List[Tuple] = []
+    month = ''
+
+    def flush() -> None:
+        if not pending:
+            return
+        directory = os.path.join(out_dir, source, f'month={month}')
+        os.makedirs(directory, exist_ok=True)
+        part = parts.get(month, 0)
+        parts[month] = part + 1
+        path = os.path.join(directory, f'part-{part:05d}.{file_format}')
+        write_part(path, columns, pending, file_format)
+        paths.append(path)
+        pending.clear()
+
+    for rows in stream_rows(conn, sql, {'since': since, 'until': until}, chunk_rows):
+        for row in rows:
+            row_month = row[0].strftime('%Y-%m')
+            if row_month != month or len(pending) >= chunk_rows:
+                flush()
+                month = row_month
+            pending.append(row)
+    flush()
+    conn.rollback()
+    return paths
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''))
+    parser.add_argument('--source', choices=sorted(SOURCES), default='funnel')
+    parser.add_argument('--since', type=date.fromisoformat, default=date(1970, 1, 1))
+    parser.add_argument('--until', type=date.fromisoformat, default=date(9999, 1, 1))
+    parser.add_argument('--out', default='funnel-export')
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+
+    conn = psycopg2.connect(args.database_url)
+    try:
+        conn.set_session(readonly=True)
+        for path in export(conn, args.source, args.since, args.until, args.out, args.format, args.chunk_rows):
+            print(path)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
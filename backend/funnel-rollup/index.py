@@ -0,0 +1,160 @@
+import os
+import hmac
+from datetime import date, timedelta
+from typing import Dict, Any
+
+from db import connection
+from export import FUNNEL_COLUMNS, SOURCES, stream_rows, to_csv
+from runtime import HttpError, Router, header, json_response, query_params
+
+ROLLUP_LAG = int(os.environ.get('FUNNEL_ROLLUP_LAG_SECONDS', '30'))
+DEFAULT_DAYS = 90
+MAX_DAYS = 3660
+
+ROLLUP_SQL = '''
+    WITH mark AS (
+        SELECT high_water FROM rollup_watermarks
+        WHERE name = 'funnel_daily'
+        FOR UPDATE SKIP LOCKED
+    ), bounds AS (
+        SELECT high_water AS since, (CURRENT_TIMESTAMP - make_interval(secs => %(lag)s))::timestamp AS until
+        FROM mark
+    ), changed AS (
+        SELECT u.created_at::date AS day
+        FROM users u, bounds b
+        WHERE u.created_at > b.since AND u.created_at <= b.until
+        UNION ALL
+        SELECT r.created_at::date
+        FROM users u
+        JOIN users r ON r.telegram_id = u.referred_by, bounds b
+        WHERE u.created_at > b.since AND u.created_at <= b.until
+        UNION ALL
+        SELECT u.created_at::date
+        FROM card_status_events e
+        JOIN users u ON u.telegram_id = e.telegram_id, bounds b
+        WHERE e.created_at > b.since AND e.created_at <= b.until
+    ), days AS (
+        SELECT DISTINCT day FROM changed
+    ), rolled AS (
+        INSERT INTO funnel_daily AS f (day, joined, card_ordered, card_activated, referred, referrers)
+        SELECT d.day, COUNT(*),
+            COUNT(*) FILTER (WHERE u.card_ordered),
+            COUNT(*) FILTER (WHERE u.card_activated),
+            COUNT(*) FILTER (WHERE u.referred_by IS NOT NULL),
+            COUNT(*) FILTER (WHERE u.referral_count > 0)
+        FROM days d
+        JOIN users u ON u.created_at >= d.day AND u.created_at < d.day + 1
+        GROUP BY d.day
+        ON CONFLICT (day) DO UPDATE SET
+            joined = EXCLUDED.joined,
+            card_ordered = EXCLUDED.card_ordered,
+            card_activated = EXCLUDED.card_activated,
+            referred = EXCLUDED.referred,
+            referrers = EXCLUDED.referrers,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING day
+    ), advanced AS (
+        UPDATE rollup_watermarks w
+        SET high_water = GREATEST(w.high_water, b.until),
+            runs = w.runs + 1,
+            rows_processed = w.rows_processed + (SELECT COUNT(*) FROM changed),
+            updated_at = CURRENT_TIMESTAMP
+        FROM bounds b
+        WHERE w.name = 'funnel_daily'
+        RETURNING w.high_water
+    )
+    SELECT (SELECT since FROM bounds), (SELECT high_water FROM advanced),
+        (SELECT COUNT(*) FROM changed), (SELECT COUNT(*) FROM rolled)
+'''
+
+WATERMARK_SQL = '''
+    SELECT high_water, runs, rows_processed FROM rollup_watermarks WHERE name = 'funnel_daily'
+'''
+
+router = Router(allow_headers='Content-Type, X-Admin-Token')
+
+
+def require_admin(event: Dict[str, Any]) -> None:
+    admin_token = os.environ.get('FUNNEL_ADMIN_TOKEN', '')
+    if not admin_token:
+        raise HttpError(403, 'Funnel admin token is not configured')
+    if not hmac.compare_digest(header(event, 'X-Admin-Token').encode('utf-8'), admin_token.encode('utf-8')):
+        raise HttpError(403, 'Forbidden')
+
+
+def parse_day(value: str, name: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HttpError(400, f'{name} must be a date YYYY-MM-DD')
+
+
+@router.route('POST')
+def rollup(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(ROLLUP_SQL, {'lag': ROLLUP_LAG})
+            since, high_water, rows, days = cur.fetchone()
+        conn.commit()
+    if high_water is None:
+        return json_response(200, {'status': 'busy'})
+    return json_response(200, {
+        'status': 'ok',
+        'since': since,
+        'high_water': high_water,
+        'rows_processed': rows,
+        'days_rolled': days,
+    })
+
+
+@router.route('GET')
+def report(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    require_admin(event)
+    params = query_params(event)
+    until = parse_day(params['to'], 'to') + timedelta(days=1) if params.get('to') else date.today() + timedelta(days=1)
+    since = parse_day(params['from'], 'from') if params.get('from') else until - timedelta(days=DEFAULT_DAYS)
+    if not timedelta(0) < until - since <= timedelta(days=MAX_DAYS):
+        raise HttpError(400, f'Period must be from 1 to {MAX_DAYS} days')
+    file_format = params.get('format', 'json')
+    if file_format not in ('json', 'csv'):
+        raise HttpError(400, 'format must be json or csv')
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(WATERMARK_SQL)
+            high_water, runs, rows_processed = cur.fetchone()
+        chunks = stream_rows(conn, SOURCES['funnel'][1], {'since': since, 'until': until})
+        if file_format == 'csv':
+            body = to_csv(FUNNEL_COLUMNS, []) + ''.join(to_csv(FUNNEL_COLUMNS, rows, header=False) for rows in chunks)
+        else:
+            days = [dict(zip(FUNNEL_COLUMNS, row)) for rows in chunks for row in rows]
+        conn.rollback()
+
+    if file_format == 'csv':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'text/csv; charset=utf-8',
+                'Content-Disposition': f'attachment; filename="funnel-{since}-{until - timedelta(days=1)}.csv"',
+                'Access-Control-Allow-Origin': '*',
+                'X-High-Water': high_water.isoformat(),
+            },
+            'isBase64Encoded': False,
+            'body': body,
+        }
+    return json_response(200, {
+        'days': days,
+        'high_water': high_water,
+        'runs': runs,
+        'rows_processed': rows_processed,
+    })
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Дневная воронка (регистрация -> заказ карты -> активация -> приглашения) по дате регистрации
+    Args: event - POST или таймер (досчитать регистрации и смены статуса карты после high-water mark), GET с X-Admin-Token
+          (from, to, format=json|csv - выгрузка сводки funnel_daily)
+    Returns: HTTP response со статистикой пересчёта или дневными строками воронки
+    '''
+    return router.dispatch(event, context)
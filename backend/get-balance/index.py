@@ -1,129 +1,200 @@
 import os
-import json
-import psycopg2
-from typing import Dict, Any
+import random
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+from change_cache import CACHE_LISTEN, CHANGES_CHANNEL, MISSING, ChangeListener, TTLCache
+from db import connection
+from rate_limit import limiter_from_env
+from runtime import JSON_HEADERS, HttpError, Router, dumps, header, query_params
+from telegram_auth import authenticate
+import tracing
+
+RESPONSE_CACHE_TTL = float(os.environ.get('BALANCE_CACHE_TTL', '30'))
+RESPONSE_CACHE_SIZE = int(os.environ.get('BALANCE_CACHE_SIZE', '10000'))
+ETAG_VERSION = 'b1'
+EPOCH = datetime(1970, 1, 1)
+
+router = Router(default_method='GET', allow_headers='Content-Type, X-Telegram-Init-Data, If-None-Match')
+limiter = limiter_from_env('get-balance')
+system_random = random.SystemRandom()
+responses = TTLCache(RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIZE)
+_lock = threading.Lock()
+_stats = {'not_modified': 0, 'db_skipped': 0, 'serialized': 0, 'generation': 0}
+
+REFERRAL_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+REFERRAL_CODE_LENGTH = 8
+GET_OR_CREATE_ATTEMPTS = 5
+
+GET_OR_CREATE_USER_SQL = '''
+    WITH existing AS (
+        SELECT balance, card_ordered, card_activated, referral_code, first_name, referral_count, updated_at
+        FROM users
+        WHERE telegram_id = %(telegram_id)s
+    ), pending AS (
+        DELETE FROM pending_referrals
+        WHERE telegram_id = %(telegram_id)s AND NOT EXISTS (SELECT 1 FROM existing)
+        RETURNING referral_code
+    ), created AS (
+        INSERT INTO users (telegram_id, username, first_name, referral_code, referred_by)
+        SELECT %(telegram_id)s, %(username)s, %(first_name)s, %(referral_code)s, (
+            SELECT r.telegram_id FROM users r
+            WHERE r.referral_code = COALESCE(%(ref)s, (SELECT referral_code FROM pending))
+                AND r.telegram_id <> %(telegram_id)s
+        )
+        WHERE NOT EXISTS (SELECT 1 FROM existing)
+        ON CONFLICT DO NOTHING
+        RETURNING balance, card_ordered, card_activated, referral_code, first_name, referral_count, updated_at,
+            referred_by
+    ), credited_referrer AS (
+        UPDATE users
+        SET referral_count = referral_count + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE telegram_id = (SELECT referred_by FROM created)
+        RETURNING pg_notify('users_changed', telegram_id::text)
+    )
+    SELECT * FROM existing
+    UNION ALL
+    SELECT balance, card_ordered, card_activated, referral_code, first_name, referral_count, updated_at
+    FROM created, pg_notify('users_changed', %(telegram_id)s::text)
+'''
+
+
+def generate_referral_code() -> str:
+    return ''.join(system_random.choices(REFERRAL_ALPHABET, k=REFERRAL_CODE_LENGTH))
+
+
+def get_or_create_user(cur: Any, telegram_id: str, username: str, first_name: str,
+                       ref: Optional[str]) -> Optional[Tuple]:
     '''
-    Business: Получение баланса пользователя или создание нового
-    Args: event с telegram_id, username, first_name
-    Returns: HTTP response с балансом и данными пользователя
+    Business: Находит пользователя или создаёт его одним запросом, привязывая пригласившего
+    Args: курсор, telegram_id, username, first_name, реферальный код пригласившего
+    Returns: строка (balance, card_ordered, card_activated, referral_code, first_name, referral_count, updated_at)
     '''
-    method: str = event.get('httpMethod', 'GET')
+    for _ in range(GET_OR_CREATE_ATTEMPTS):
+        cur.execute(GET_OR_CREATE_USER_SQL, {
+            'telegram_id': telegram_id,
+            'username': username,
+            'first_name': first_name,
+            'referral_code': generate_referral_code(),
+            'ref': ref,
+        })
+        row = cur.fetchone()
+        if row:
+            return row
+    return None
+
+
+def _count(name: str) -> None:
+    with _lock:
+        _stats[name] += 1
+
+
+def on_change(payload: str) -> None:
+    responses.invalidate(int(payload))
+    _count('generation')
+
+
+def on_reset() -> None:
+    responses.clear()
+    _count('generation')
+
+
+listener = ChangeListener(CHANGES_CHANNEL, on_change, on_reset)
+
+
+def make_etag(telegram_id: int, updated_at: datetime) -> str:
+    micros = (updated_at - EPOCH) // EPOCH.resolution
+    return f'"{ETAG_VERSION}.{telegram_id}.{micros:x}"'
+
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    if_none_match = header(event, 'If-None-Match')
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == '*' or candidate == etag:
+            return True
+    return False
+
+
+def balance_response(event: Dict[str, Any], etag: str, body: str) -> Dict[str, Any]:
+    headers = {**JSON_HEADERS, 'ETag': etag, 'Cache-Control': 'private, no-cache',
+               'Access-Control-Expose-Headers': 'ETag'}
+    if etag_matches(event, etag):
+        _count('not_modified')
+        return {'statusCode': 304, 'headers': headers, 'isBase64Encoded': False, 'body': ''}
+    return {'statusCode': 200, 'headers': headers, 'isBase64Encoded': False, 'body': body}
+
+
+@router.route('GET')
+def get_balance(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    params = query_params(event)
+    claims = authenticate(event, params.get('telegram_id'))
+    telegram_id = claims['telegram_id']
+    username = claims['username'] or params.get('username', '')
+    first_name = claims['first_name'] or params.get('first_name', 'Гость')
+    ref = (claims['start_param'] or params.get('ref') or '').strip().upper() or None
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    if params.get('telegram_id') and params['telegram_id'] != str(telegram_id):
+        raise HttpError(403, 'telegram_id does not match initData')
     
-    if method == 'GET':
-        try:
-            params = event.get('queryStringParameters', {}) or {}
-            telegram_id = params.get('telegram_id')
-            username = params.get('username', '')
-            first_name = params.get('first_name', 'Гость')
-            
-            if not telegram_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'telegram_id is required'})
-                }
-            
-            dsn = os.environ.get('DATABASE_URL', '')
-            
-            conn = psycopg2.connect(dsn)
-            cur = conn.cursor()
-            
-            cur.execute(
-                "SELECT id, balance, card_ordered, card_activated, referral_code, first_name FROM users WHERE telegram_id = %s",
-                (telegram_id,)
-            )
-            result = cur.fetchone()
-            
-            if result:
-                user_id, balance, card_ordered, card_activated, referral_code, db_first_name = result
-                
-                cur.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'isBase64Encoded': False,
-                    'body': json.dumps({
-                        'telegram_id': int(telegram_id),
-                        'balance': float(balance),
-                        'card_ordered': card_ordered,
-                        'card_activated': card_activated,
-                        'referral_code': referral_code,
-                        'first_name': db_first_name or first_name
-                    })
-                }
-            
-            import random
-            import string
-            referral_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-            
-            cur.execute(
-                "INSERT INTO users (telegram_id, username, first_name, referral_code) VALUES (%s, %s, %s, %s) RETURNING id, balance",
-                (telegram_id, username, first_name, referral_code)
-            )
-            user_id, balance = cur.fetchone()
-            conn.commit()
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({
-                    'telegram_id': int(telegram_id),
-                    'balance': float(balance),
-                    'card_ordered': False,
-                    'card_activated': False,
-                    'referral_code': referral_code,
-                    'first_name': first_name
-                })
-            }
-            
-        except Exception as e:
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': str(e)})
-            }
+    limiter.check(event, telegram_id)
+
+    live = CACHE_LISTEN and listener.poll()
+    generation = _stats['generation']
+    if live:
+        cached = responses.get(telegram_id)
+        if cached is not MISSING:
+            _count('db_skipped')
+            return balance_response(event, *cached)
+    
+    with connection() as conn:
+        with conn.cursor() as cur:
+            result = get_or_create_user(cur, telegram_id, username, first_name, ref)
+        conn.commit()
+    
+    if not result:
+        raise HttpError(503, 'Could not create user, retry later')
     
-    return {
-        'statusCode': 405,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'isBase64Encoded': False,
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
+    balance, card_ordered, card_activated, referral_code, db_first_name, referral_count, updated_at = result
+    etag = make_etag(telegram_id, updated_at)
+    if not live:
+        cached = responses.get(telegram_id)
+        if cached is not MISSING and cached[0] == etag:
+            return balance_response(event, *cached)
+
+    body = dumps({
+        'telegram_id': int(telegram_id),
+        'balance': balance,
+        'card_ordered': card_ordered,
+        'card_activated': card_activated,
+        'referral_code': referral_code,
+        'referral_count': referral_count,
+        'first_name': db_first_name or first_name
+    })
+    _count('serialized')
+    if CACHE_LISTEN:
+        listener.poll()
+    if generation == _stats['generation']:
+        responses.put(telegram_id, (etag, body))
+    return balance_response(event, etag, body)
+
+
+def balance_cache_stats() -> Dict[str, Any]:
+    return {**_stats, **responses.stats()}
+
+
+tracing.register('balance_cache', balance_cache_stats)
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Получение баланса пользователя или создание нового
+    Args: event с X-Telegram-Init-Data (подписанные данные Mini App)
+    Returns: HTTP response с балансом и данными пользователя
+    '''
+    return router.dispatch(event, context)
@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import psycopg2
+
+from db import PoolTimeout, connection
+from runtime import HttpError
+import tracing
+
+USER_PER_MINUTE = float(os.environ.get('RATE_LIMIT_USER_PER_MINUTE', '60'))
+USER_BURST = float(os.environ.get('RATE_LIMIT_USER_BURST', '20'))
+IP_PER_MINUTE = float(os.environ.get('RATE_LIMIT_IP_PER_MINUTE', '300'))
+IP_BURST = float(os.environ.get('RATE_LIMIT_IP_BURST', '100'))
+MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '50000'))
+SHARED = os.environ.get('RATE_LIMIT_SHARED', '1') == '1'
+SYNC_INTERVAL = float(os.environ.get('RATE_LIMIT_SYNC_INTERVAL', '2'))
+ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+
+SYNC_SQL = '''
+    WITH purged AS (
+        DELETE FROM rate_limits
+        WHERE key IN (
+            SELECT key FROM rate_limits
+            WHERE updated_at < CURRENT_TIMESTAMP - INTERVAL '1 hour'
+            LIMIT 100
+            FOR UPDATE SKIP LOCKED
+        )
+    ), upserted AS (
+        INSERT INTO rate_limits AS r (key, tokens, rate, burst, rejected)
+        SELECT key, burst - hits, rate, burst, rejected
+        FROM unnest(%s::text[], %s::integer[], %s::integer[], %s::float8[], %s::float8[])
+            AS h(key, hits, rejected, rate, burst)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = GREATEST(
+                -EXCLUDED.burst,
+                LEAST(EXCLUDED.burst, r.tokens + r.rate * EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - r.updated_at))
+                    - (EXCLUDED.burst - EXCLUDED.tokens)
+            ),
+            rate = EXCLUDED.rate,
+            burst = EXCLUDED.burst,
+            rejected = r.rejected + EXCLUDED.rejected,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING key, tokens, rate
+    )
+    SELECT key, tokens, rate FROM upserted WHERE tokens < 0
+'''
+
+
+def source_ip(event: Dict[str, Any]) -> str:
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    if identity.get('sourceIp'):
+        return identity['sourceIp']
+    headers = event.get('headers') or {}
+    forwarded = headers.get('X-Forwarded-For') or headers.get('x-forwarded-for') or ''
+    return forwarded.split(',')[0].strip()
+
+
+class RateLimiter:
+    '''
+    Business: Token bucket на telegram_id и IP; отказ без обращения к базе
+    Args: префикс ключей (имя функции), лимиты {вид ключа: (токенов в секунду, размер пачки)}
+    '''
+
+    def __init__(self, scope: str, limits: Dict[str, Tuple[float, float]]) -> None:
+        self.scope = scope
+        self.limits = limits
+        self._buckets: 'OrderedDict[Tuple[str, str], List[float]]' = OrderedDict()
+        self._pending: Dict[Tuple[str, str], List[int]] = {}
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+        self._stats = {'allowed': 0, 'rejected': 0, 'syncs': 0, 'sync_errors': 0, 'shared_blocks': 0}
+        self._rejected_by_kind = {kind: 0 for kind in limits}
+
+    def _bucket(self, key: Tuple[str, str], now: float) -> List[float]:
+        rate, burst = self.limits[key[0]]
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now, 0.0]
+            if len(self._buckets) > MAX_KEYS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def check(self, event: Dict[str, Any], telegram_id: Optional[Any] = None) -> None:
+        '''
+        Business: Списывает по токену с каждого ключа запроса или отклоняет запрос с 429
+        Args: event (для IP), telegram_id пользователя
+        '''
+        if not ENABLED:
+            return
+        keys = []
+        ip = source_ip(event)
+        if ip and 'ip' in self.limits:
+            keys.append(('ip', ip))
+        if telegram_id is not None and 'tid' in self.limits:
+            keys.append(('tid', str(telegram_id)))
+
+        now = time.monotonic()
+        with self._lock:
+            retry_after = 0.0
+            for key in keys:
+                bucket = self._bucket(key, now)
+                rate = self.limits[key[0]][0]
+                if bucket[2] > now:
+                    wait = bucket[2] - now
+                elif bucket[0] < 1:
+                    wait = (1 - bucket[0]) / rate
+                else:
+                    continue
+                retry_after = max(retry_after, wait)
+                self._rejected_by_kind[key[0]] += 1
+                self._pending.setdefault(key, [0, 0])[1] += 1
+            if retry_after:
+                self._stats['rejected'] += 1
+                raise HttpError(429, 'Too many requests', headers={'Retry-After': str(int(retry_after) + 1)},
+                                retry_after=round(retry_after, 1))
+            for key in keys:
+                self._buckets[key][0] -= 1
+                self._pending.setdefault(key, [0, 0])[0] += 1
+            self._stats['allowed'] += 1
+            sync_due = SHARED and now >= self._next_sync
+            if sync_due:
+                self._next_sync = now + SYNC_INTERVAL
+                pending, self._pending = self._pending, {}
+
+        if sync_due and pending:
+            self.sync(pending)
+
+    def sync(self, pending: Dict[Tuple[str, str], List[int]]) -> None:
+        '''
+        Business: Сводит локальные списания в общую таблицу rate_limits и получает блокировки других инстансов
+        Args: накопленные (списано, отклонено) по ключам
+        '''
+        names = {f'{self.scope}:{kind}:{value}': (kind, value) for kind, value in pending}
+        counts = list(pending.values())
+        limits = [self.limits[kind] for kind, _ in pending]
+        try:
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(SYNC_SQL, (
+                        list(names),
+                        [hits for hits, _ in counts],
+                        [rejected for _, rejected in counts],
+                        [rate for rate, _ in limits],
+                        [burst for _, burst in limits],
+                    ))
+                    blocked = cur.fetchall()
+                conn.commit()
+        except (psycopg2.Error, PoolTimeout):
+            with self._lock:
+                self._stats['sync_errors'] += 1
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            self._stats['syncs'] += 1
+            for name, tokens, rate in blocked:
+                bucket = self._buckets.get(names[name])
+                if bucket is not None:
+                    bucket[0] = min(bucket[0], 0.0)
+                    bucket[2] = now + (1 - tokens) / rate
+                    self._stats['shared_blocks'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, 'rejected_by_kind': dict(self._rejected_by_kind), 'keys': len(self._buckets)}
+
+
+def limiter_from_env(scope: str) -> RateLimiter:
+    limiter = RateLimiter(scope, {
+        'tid': (USER_PER_MINUTE / 60, USER_BURST),
+        'ip': (IP_PER_MINUTE / 60, IP_BURST),
+    })
+    tracing.register('rate_limit', limiter.stats)
+    return limiter
@@ -0,0 +1,258 @@
+import os
+import random
+import time
+from typing import Dict, Any, List, Tuple
+
+from db import connection
+from runtime import HttpError, Router, json_response
+from telegram_api import CONNECT_TIMEOUT, READ_TIMEOUT, BotApiError, RateLimiter, get_client
+
+WEB_APP_URL = 'https://alpha-card-project--preview.poehali.dev/'
+
+BATCH_SIZE = int(os.environ.get('NOTIFY_BATCH_SIZE', '100'))
+MAX_ATTEMPTS = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', '8'))
+LEASE_SECONDS = int(os.environ.get('NOTIFY_LEASE_SECONDS', '60'))
+TIME_BUDGET = float(os.environ.get('NOTIFY_TIME_BUDGET', '20'))
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 3600.0
+
+GLOBAL_RATE = 30.0
+PER_CHAT_INTERVAL = 1.0
+SEND_RESERVE = CONNECT_TIMEOUT + READ_TIMEOUT
+
+if LEASE_SECONDS < TIME_BUDGET + 2 * SEND_RESERVE:
+    raise ValueError('NOTIFY_LEASE_SECONDS must exceed NOTIFY_TIME_BUDGET plus two worst-case sends')
+
+CLAIM_SQL = '''
+    UPDATE notification_outbox
+    SET next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %(lease)s), attempts = attempts + 1
+    WHERE id IN (
+        SELECT id FROM notification_outbox
+        WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+        ORDER BY next_attempt_at
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, chat_id, kind, params, attempts
+'''
+
+MARK_SENT_SQL = '''
+    UPDATE notification_outbox
+    SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+    WHERE id = ANY(%s)
+'''
+
+RELEASE_SQL = '''
+    UPDATE notification_outbox
+    SET next_attempt_at = CURRENT_TIMESTAMP, attempts = attempts - 1
+    WHERE id = ANY(%s)
+'''
+
+MARK_RETRY_SQL = '''
+    UPDATE notification_outbox o
+    SET next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => r.delay), last_error = r.error
+    FROM unnest(%s::bigint[], %s::float8[], %s::text[]) AS r(id, delay, error)
+    WHERE o.id = r.id
+'''
+
+MARK_FAILED_SQL = '''
+    UPDATE notification_outbox o
+    SET status = 'failed', last_error = r.error
+    FROM unnest(%s::bigint[], %s::text[]) AS r(id, error)
+    WHERE o.id = r.id
+'''
+
+
+def render_card_activated(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'text': (
+            "🎉 *Поздравляем!*\n\n"
+            f"Ваша карта успешно активирована!\n"
+            f"💰 Бонус *500₽* зачислен на ваш баланс!\n\n"
+            f"Ваш новый баланс: *{float(params['balance'])}₽*\n\n"
+            "Теперь вы можете:\n"
+            "• Вывести средства через СБП\n"
+            "• Пригласить друзей и получить ещё больше!\n\n"
+            "Откройте приложение, чтобы продолжить 👇"
+        ),
+        'parse_mode': 'Markdown',
+        'reply_markup': {
+            'inline_keyboard': [[
+                {
+                    'text': '🚀 Открыть приложение',
+                    'web_app': {'url': WEB_APP_URL}
+                }
+            ]]
+        }
+    }
+
+
+def render_referral_bonus(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'text': (
+            "👥 *Ваш друг активировал карту!*\n\n"
+            "💰 Бонус *200₽* за приглашение зачислен на ваш баланс.\n\n"
+            f"Ваш новый баланс: *{float(params['balance'])}₽*\n\n"
+            "Приглашайте ещё друзей и зарабатывайте больше 👇"
+        ),
+        'parse_mode': 'Markdown',
+        'reply_markup': {
+            'inline_keyboard': [[
+                {
+                    'text': '🚀 Открыть приложение',
+                    'web_app': {'url': WEB_APP_URL}
+                }
+            ]]
+        }
+    }
+
+
+def render_withdrawal_completed(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'text': (
+            "✅ *Вывод выполнен*\n\n"
+            f"*{float(params['amount'])}₽* отправлены по СБП. "
+            "Деньги поступят на ваш счёт в течение нескольких минут."
+        ),
+        'parse_mode': 'Markdown'
+    }
+
+
+def render_withdrawal_failed(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'text': (
+            "⚠️ *Не удалось выполнить вывод*\n\n"
+            f"Сумма *{float(params['amount'])}₽* возвращена на ваш баланс.\n"
+            f"Текущий баланс: *{float(params['balance'])}₽*\n\n"
+            "Проверьте номер телефона и банк и попробуйте ещё раз или напишите в поддержку @Alfa_Bank778."
+        ),
+        'parse_mode': 'Markdown'
+    }
+
+
+RENDERERS = {
+    'card_activated': render_card_activated,
+    'referral_bonus': render_referral_bonus,
+    'withdrawal_completed': render_withdrawal_completed,
+    'withdrawal_failed': render_withdrawal_failed,
+}
+
+
+router = Router(allow_headers='Content-Type')
+limiter = RateLimiter(GLOBAL_RATE, PER_CHAT_INTERVAL)
+
+
+def send_message(bot_token: str, payload: Dict[str, Any]) -> Tuple[str, float, str]:
+    '''
+    Business: Отправка одного сообщения в Bot API
+    Returns: (sent | retry | failed, задержка до повтора, текст ошибки)
+    '''
+    try:
+        get_client(bot_token).call('sendMessage', payload)
+        return 'sent', 0.0, ''
+    except BotApiError as e:
+        if e.status == 429:
+            return 'retry', e.retry_after or 1.0, e.description
+        if e.status == 0 or e.status >= 500:
+            return 'retry', 0.0, e.description
+        return 'failed', 0.0, e.description
+
+
+def backoff(attempts: int) -> float:
+    delay = min(BACKOFF_BASE ** attempts, BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def process_batch(bot_token: str, rows: List[Tuple], deadline: float) -> Dict[str, List]:
+    '''
+    Business: Отправка пачки; сообщение не начинается, если может не успеть до конца бюджета времени -
+              оставшиеся строки возвращаются в очередь, чтобы отправленные успели отметиться до конца аренды
+    Args: токен бота, захваченные строки outbox, момент окончания бюджета (time.monotonic)
+    Returns: id отправленных, отложенных, ошибочных и возвращённых в очередь уведомлений
+    '''
+    result: Dict[str, List] = {'sent': [], 'retry': [], 'failed': [], 'released': []}
+    resume_at = 0.0
+    for index, (notification_id, chat_id, kind, params, attempts) in enumerate(rows):
+        if max(time.monotonic(), resume_at) + SEND_RESERVE > deadline:
+            result['released'] = [row[0] for row in rows[index:]]
+            break
+        render = RENDERERS.get(kind)
+        if render is None:
+            result['failed'].append((notification_id, f'Unknown kind {kind}'))
+            continue
+        try:
+            payload = {'chat_id': chat_id, **render(params)}
+            limiter.wait(chat_id)
+            outcome, retry_after, error = send_message(bot_token, payload)
+        except Exception as e:
+            result['failed'].append((notification_id, f'{type(e).__name__}: {e}'))
+            continue
+        if outcome == 'sent':
+            result['sent'].append(notification_id)
+        elif outcome == 'retry' and attempts < MAX_ATTEMPTS:
+            if retry_after:
+                limiter.pause(retry_after)
+                resume_at = max(resume_at, time.monotonic() + retry_after)
+            result['retry'].append((notification_id, max(retry_after, backoff(attempts)), error))
+        else:
+            result['failed'].append((notification_id, error))
+    return result
+
+
+def drain(bot_token: str, deadline: float) -> Dict[str, int]:
+    stats = {'claimed': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'released': 0}
+    while time.monotonic() + SEND_RESERVE <= deadline:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(CLAIM_SQL, {'lease': LEASE_SECONDS, 'limit': BATCH_SIZE})
+                rows = cur.fetchall()
+            conn.commit()
+        if not rows:
+            break
+        stats['claimed'] += len(rows)
+
+        result = process_batch(bot_token, rows, deadline)
+
+        with connection() as conn:
+            with conn.cursor() as cur:
+                if result['sent']:
+                    cur.execute(MARK_SENT_SQL, (result['sent'],))
+                if result['released']:
+                    cur.execute(RELEASE_SQL, (result['released'],))
+                if result['retry']:
+                    ids, delays, errors = zip(*result['retry'])
+                    cur.execute(MARK_RETRY_SQL, (list(ids), list(delays), list(errors)))
+                if result['failed']:
+                    ids, errors = zip(*result['failed'])
+                    cur.execute(MARK_FAILED_SQL, (list(ids), list(errors)))
+            conn.commit()
+        stats['sent'] += len(result['sent'])
+        stats['retried'] += len(result['retry'])
+        stats['failed'] += len(result['failed'])
+        stats['released'] += len(result['released'])
+    return stats
+
+
+@router.route('POST')
+def drain_outbox(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+    if not bot_token:
+        raise HttpError(500, 'TELEGRAM_BOT_TOKEN is not configured')
+
+    started = time.monotonic()
+    stats = drain(bot_token, started + TIME_BUDGET)
+
+    return json_response(200, {
+        **stats,
+        'duration': round(time.monotonic() - started, 3),
+        'api': get_client(bot_token).stats()
+    })
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Отправка уведомлений из outbox в Telegram (запуск по таймеру или POST)
+    Args: event - вызов по расписанию или HTTP POST
+    Returns: HTTP response со статистикой отправки
+    '''
+    return router.dispatch(event, context)
@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+from db import CONNECT_TIMEOUT
+
+CACHE_LISTEN = os.environ.get('USER_CACHE_LISTEN', '1') == '1'
+CHANGES_CHANNEL = 'users_changed'
+LISTEN_RETRY_MIN = 1.0
+LISTEN_RETRY_MAX = float(os.environ.get('USER_CACHE_LISTEN_RETRY_MAX', '60'))
+
+MISSING = object()
+
+
+class TTLCache:
+    '''
+    Business: LRU-кэш с ограниченным временем жизни записей и счётчиками попаданий
+    Args: TTL в секундах, максимальное число записей
+    '''
+
+    def __init__(self, ttl: float, max_size: int) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: 'OrderedDict[Any, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'resets': 0}
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._stats['misses'] += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, key: Any) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats['resets'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'size': len(self._entries),
+                'hit_ratio': round(self._stats['hits'] / lookups, 4) if lookups else 0.0,
+            }
+
+
+class ChangeListener:
+    '''
+    Business: Получает уведомления об изменении пользователей через LISTEN/NOTIFY на отдельном соединении
+              (одно на тёплый инстанс сверх DB_POOL_MAX_SIZE); после ошибки переподключается не чаще,
+              чем раз в растущую от LISTEN_RETRY_MIN до LISTEN_RETRY_MAX паузу
+    Args: канал, обработчик изменения одного ключа, обработчик потери уведомлений
+    '''
+
+    def __init__(self, channel: str, on_change: Callable[[str], None], on_reset: Callable[[], None]) -> None:
+        self.channel = channel
+        self.on_change = on_change
+        self.on_reset = on_reset
+        self._conn: Any = None
+        self._lock = threading.Lock()
+        self._retry_at = 0.0
+        self._retry_delay = LISTEN_RETRY_MIN
+
+    def _listen(self) -> None:
+        self._conn = psycopg2.connect(os.environ.get('DATABASE_URL', ''), connect_timeout=CONNECT_TIMEOUT)
+        self._conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with self._conn.cursor() as cur:
+            cur.execute(f'LISTEN {self.channel}')
+        self.on_reset()
+
+    def poll(self) -> bool:
+        '''
+        Business: Применяет накопившиеся уведомления, при необходимости переподключаясь
+        Returns: True, если уведомления доходят и кэшу можно доверять
+        '''
+        with self._lock:
+            if self._conn is None and time.monotonic() < self._retry_at:
+                return False
+            try:
+                if self._conn is None or self._conn.closed:
+                    self._listen()
+                self._conn.poll()
+                while self._conn.notifies:
+                    self.on_change(self._conn.notifies.pop(0).payload)
+            except psycopg2.Error:
+                if self._conn is not None:
+                    self._conn.close()
+                self._conn = None
+                self._retry_at = time.monotonic() + self._retry_delay
+                self._retry_delay = min(self._retry_delay * 2, LISTEN_RETRY_MAX)
+                self.on_reset()
+                return False
+            self._retry_delay = LISTEN_RETRY_MIN
+            return True
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from typing import Dict, Any, List
+
+import psycopg2
+
+from change_cache import TTLCache
+from db import PoolTimeout, connection
+import tracing
+
+DEDUP_TTL = int(os.environ.get('DEDUP_TTL', '86400'))
+DEDUP_MAX_SIZE = int(os.environ.get('DEDUP_MAX_SIZE', '50000'))
+DEDUP_CLEANUP_INTERVAL = float(os.environ.get('DEDUP_CLEANUP_INTERVAL', '300'))
+DEDUP_CLEANUP_BATCH = 1000
+
+CLAIM_SQL = '''
+    INSERT INTO processed_updates (update_key)
+    SELECT unnest(%(keys)s::text[])
+    ON CONFLICT (update_key) DO NOTHING
+'''
+
+CLAIM_AND_PURGE_SQL = '''
+    WITH purged AS (
+        DELETE FROM processed_updates
+        WHERE update_key IN (
+            SELECT update_key FROM processed_updates
+            WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %(ttl)s)
+            LIMIT %(batch)s
+            FOR UPDATE SKIP LOCKED
+        )
+    )
+    INSERT INTO processed_updates (update_key)
+    SELECT unnest(%(keys)s::text[])
+    ON CONFLICT (update_key) DO NOTHING
+'''
+
+RELEASE_SQL = 'DELETE FROM processed_updates WHERE update_key = ANY(%s)'
+
+seen = TTLCache(DEDUP_TTL, DEDUP_MAX_SIZE)
+_stats = {'claimed': 0, 'local_duplicates': 0, 'db_duplicates': 0, 'db_errors': 0, 'purges': 0}
+_lock = threading.Lock()
+_next_purge = 0.0
+
+
+def update_keys(update: Dict[str, Any]) -> List[str]:
+    '''
+    Business: Ключи идемпотентности webhook-обновления Telegram
+    Args: тело update
+    Returns: u:<update_id> и cq:<callback_query.id>, если они есть
+    '''
+    keys = []
+    if update.get('update_id') is not None:
+        keys.append(f"u:{update['update_id']}")
+    callback_id = (update.get('callback_query') or {}).get('id')
+    if callback_id:
+        keys.append(f'cq:{callback_id}')
+    return keys
+
+
+def _count(name: str) -> None:
+    with _lock:
+        _stats[name] += 1
+
+
+def _purge_due() -> bool:
+    global _next_purge
+    now = time.monotonic()
+    with _lock:
+        if now < _next_purge:
+            return False
+        _next_purge = now + DEDUP_CLEANUP_INTERVAL
+        _stats['purges'] += 1
+        return True
+
+
+def claim(keys: List[str]) -> bool:
+    '''
+    Business: Помечает обновление обработанным; повторные доставки от Telegram отбрасываются
+    Args: ключи из update_keys
+    Returns: True, если обновление новое и его нужно обработать
+    '''
+    if not keys:
+        return True
+    if any(seen.get(key) is True for key in keys):
+        _count('local_duplicates')
+        return False
+    try:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                sql = CLAIM_AND_PURGE_SQL if _purge_due() else CLAIM_SQL
+                cur.execute(sql, {'keys': keys, 'ttl': DEDUP_TTL, 'batch': DEDUP_CLEANUP_BATCH})
+                inserted = cur.rowcount
+            conn.commit()
+    except (psycopg2.Error, PoolTimeout):
+        _count('db_errors')
+        inserted = len(keys)
+    for key in keys:
+        seen.put(key, True)
+    if inserted < len(keys):
+        _count('db_duplicates')
+        return False
+    _count('claimed')
+    return True
+
+
+def release(keys: List[str]) -> None:
+    '''
+    Business: Снимает отметку, если обработка упала, чтобы повтор от Telegram прошёл
+    Args: ключи из update_keys
+    '''
+    for key in keys:
+        seen.invalidate(key)
+    try:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(RELEASE_SQL, (keys,))
+            conn.commit()
+    except (psycopg2.Error, PoolTimeout):
+        _count('db_errors')
+
+
+def dedup_stats() -> Dict[str, Any]:
+    with _lock:
+        return {**_stats, 'local': seen.stats()}
+
+
+tracing.register('dedup', dedup_stats)
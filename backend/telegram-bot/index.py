@@ -1,232 +1,106 @@
 import os
-import json
+import re
 from typing import Dict, Any
 
+import psycopg2
+
+from db import PoolTimeout, connection
+from dedup import claim, release, update_keys
+from runtime import Router, json_response, parse_json_body
+from responses import CALLBACKS, COMMANDS, PERSONALIZED_TEXTS, UNAVAILABLE, UNKNOWN_CALLBACK, render, render_personalized
+from telegram_api import BotApiError, get_client
+from user_cache import get_user
+
+router = Router(allow_headers='Content-Type')
+
+OK_RESPONSE = json_response(200, {'ok': True}, headers={'Content-Type': 'application/json'})
+DUPLICATE_RESPONSE = json_response(200, {'ok': True, 'duplicate': True}, headers={'Content-Type': 'application/json'})
+
+REFERRAL_CODE_RE = re.compile(r'^[A-Z0-9]{4,50}$')
+
+REMEMBER_REFERRAL_SQL = '''
+    INSERT INTO pending_referrals (telegram_id, referral_code)
+    SELECT %(telegram_id)s, %(referral_code)s
+    WHERE NOT EXISTS (SELECT 1 FROM users WHERE telegram_id = %(telegram_id)s)
+    ON CONFLICT (telegram_id) DO NOTHING
+'''
+
+
+def remember_referral(telegram_id: int, referral_code: str) -> None:
+    '''
+    Business: Запоминает код пригласившего из /start <code> до первого открытия приложения
+    Args: telegram_id нового пользователя, реферальный код
+    '''
+    referral_code = referral_code.upper()
+    if not REFERRAL_CODE_RE.match(referral_code):
+        return
+    try:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(REMEMBER_REFERRAL_SQL, {'telegram_id': telegram_id, 'referral_code': referral_code})
+            conn.commit()
+    except (psycopg2.Error, PoolTimeout):
+        pass
+
+
+def render_callback(callback_data: str, chat_id: int, user_id: int) -> bytes:
+    if callback_data not in PERSONALIZED_TEXTS:
+        return render(CALLBACKS.get(callback_data, UNKNOWN_CALLBACK), chat_id)
+    try:
+        user = get_user(user_id)
+    except (psycopg2.Error, PoolTimeout):
+        return render(UNAVAILABLE, chat_id)
+    return render_personalized(callback_data, chat_id, user)
+
+
+@router.route('POST')
+def handle_update(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    body_data = parse_json_body(event)
+    keys = update_keys(body_data)
+    if not claim(keys):
+        return DUPLICATE_RESPONSE
+    try:
+        process_update(body_data)
+    except Exception:
+        release(keys)
+        raise
+    return OK_RESPONSE
+
+
+def process_update(body_data: Dict[str, Any]) -> None:
+    message = body_data.get('message', {})
+    callback_query = body_data.get('callback_query', {})
+    
+    chat_id = message.get('chat', {}).get('id') or callback_query.get('message', {}).get('chat', {}).get('id')
+    text = message.get('text', '')
+    callback_data = callback_query.get('data', '')
+    
+    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+    
+    command, _, argument = text.partition(' ')
+    if command == '/start' and argument and message.get('from', {}).get('id'):
+        remember_referral(message['from']['id'], argument.strip())
+    
+    template = COMMANDS.get(command)
+    if template and chat_id and bot_token:
+        try:
+            get_client(bot_token).call('sendMessage', render(template, chat_id))
+        except BotApiError:
+            pass
+    
+    if callback_data and chat_id and bot_token:
+        user_id = callback_query.get('from', {}).get('id') or chat_id
+        calls = [('sendMessage', render_callback(callback_data, chat_id, user_id))]
+        if callback_query.get('id'):
+            calls.append(('answerCallbackQuery', {'callback_query_id': callback_query['id']}))
+        
+        get_client(bot_token).call_many(calls)
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Telegram bot webhook handler для Mini App
     Args: event - webhook update от Telegram
     Returns: HTTP response для Telegram
     '''
-    method: str = event.get('httpMethod', 'POST')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    if method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        message = body_data.get('message', {})
-        callback_query = body_data.get('callback_query', {})
-        
-        chat_id = message.get('chat', {}).get('id') or callback_query.get('message', {}).get('chat', {}).get('id')
-        text = message.get('text', '')
-        callback_data = callback_query.get('data', '')
-        
-        bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
-        web_app_url = 'https://alpha-card-project--preview.poehali.dev/'
-        
-        if text == '/start' and chat_id and bot_token:
-            response_text = (
-                "👋 Добро пожаловать в реферальную программу Альфа-Банка!\n\n"
-                "🎁 Получите 1000₽ бонусом за оформление карты\n"
-                "💰 Зарабатывайте 200₽ за каждого друга\n\n"
-                "📱 Установите приложение на телефон:\n"
-                "1. Откройте приложение (кнопка ниже)\n"
-                "2. iPhone: Safari → Поделиться → На экран «Домой»\n"
-                "3. Android: Chrome → Меню (⋮) → Установить приложение\n\n"
-                "Нажмите кнопку, чтобы начать! 👇"
-            )
-            
-            import urllib.request
-            
-            keyboard = {
-                'inline_keyboard': [
-                    [{
-                        'text': '🚀 Открыть приложение',
-                        'web_app': {'url': web_app_url}
-                    }],
-                    [
-                        {
-                            'text': '💳 Оформить карту',
-                            'web_app': {'url': f'{web_app_url}?page=card-order'}
-                        },
-                        {
-                            'text': '💰 Баланс',
-                            'web_app': {'url': web_app_url}
-                        }
-                    ],
-                    [
-                        {
-                            'text': '👥 Пригласить друга',
-                            'web_app': {'url': f'{web_app_url}?page=referral'}
-                        },
-                        {
-                            'text': '💸 Вывести деньги',
-                            'web_app': {'url': f'{web_app_url}?page=withdraw'}
-                        }
-                    ],
-                    [{
-                        'text': '❓ Помощь',
-                        'web_app': {'url': f'{web_app_url}?page=support'}
-                    }],
-                    [{
-                        'text': '📱 Как установить на телефон?',
-                        'callback_data': 'install_guide'
-                    }]
-                ]
-            }
-            
-            send_data = {
-                'chat_id': chat_id,
-                'text': response_text,
-                'reply_markup': keyboard
-            }
-            
-            send_url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
-            req_data = json.dumps(send_data).encode('utf-8')
-            req = urllib.request.Request(
-                send_url,
-                data=req_data,
-                headers={'Content-Type': 'application/json'}
-            )
-            
-            try:
-                with urllib.request.urlopen(req) as response:
-                    response.read()
-            except Exception:
-                pass
-        
-        if callback_data and chat_id and bot_token:
-            import urllib.request
-            
-            response_texts = {
-                'order_card': (
-                    "💳 *Оформление карты Альфа-Банка*\n\n"
-                    "🎁 Получите 1000₽ бонусом:\n"
-                    "• 500₽ от нас\n"
-                    "• 500₽ от Альфа-Банка\n\n"
-                    "📝 Инструкция:\n"
-                    "1. Перейдите по ссылке: https://alfa.me/ASQWHN\n"
-                    "2. Оформите карту\n"
-                    "3. Активируйте в приложении\n"
-                    "4. Совершите покупку от 200₽\n"
-                    "5. Пришлите чек в @Alfa_Bank778\n\n"
-                    "✨ Бесплатное обслуживание и кэшбэк!"
-                ),
-                'balance': (
-                    "💰 *Ваш баланс*\n\n"
-                    "Текущий баланс: *0 ₽*\n\n"
-                    "Чтобы пополнить баланс:\n"
-                    "• Оформите карту Альфа-Банка (+500₽)\n"
-                    "• Пригласите друзей (+200₽ за каждого)"
-                ),
-                'referral': (
-                    "👥 *Реферальная программа*\n\n"
-                    "💸 Зарабатывайте 200₽ за каждого друга!\n\n"
-                    "Ваша реферальная ссылка:\n"
-                    "`https://alfacard.promo/ref/ABC123`\n\n"
-                    "Как это работает:\n"
-                    "1. Отправьте ссылку другу\n"
-                    "2. Друг регистрируется и оформляет карту\n"
-                    "3. Вы оба получаете бонусы!\n\n"
-                    "Приглашено друзей: *0*"
-                ),
-                'withdraw': (
-                    "💸 *Вывод средств*\n\n"
-                    "Доступно к выводу: *0 ₽*\n\n"
-                    "Вывод осуществляется через СБП (Систему Быстрых Платежей) "
-                    "на любой банк без комиссии.\n\n"
-                    "Откройте приложение для оформления заявки на вывод."
-                ),
-                'help': (
-                    "❓ *Помощь и поддержка*\n\n"
-                    "📱 Telegram: @Alfa_Bank778\n"
-                    "📧 Email: support@alfacard.promo\n\n"
-                    "🕐 Время работы:\n"
-                    "Ежедневно с 9:00 до 21:00 (МСК)\n\n"
-                    "Мы всегда готовы помочь вам!"
-                ),
-                'install_guide': (
-                    "📱 *Как установить приложение на телефон*\n\n"
-                    "🍎 *Для iPhone (iOS):*\n"
-                    "1. Откройте приложение через Safari\n"
-                    "2. Нажмите кнопку «Поделиться» (↑)\n"
-                    "3. Прокрутите вниз и выберите «На экран «Домой»»\n"
-                    "4. Нажмите «Добавить»\n\n"
-                    "🤖 *Для Android:*\n"
-                    "1. Откройте приложение через Chrome\n"
-                    "2. Нажмите меню (⋮) в правом верхнем углу\n"
-                    "3. Выберите «Установить приложение» или «Добавить на главный экран»\n"
-                    "4. Нажмите «Установить»\n\n"
-                    "✨ После установки приложение будет работать как обычное приложение с иконкой на главном экране!"
-                )
-            }
-            
-            response_text = response_texts.get(callback_data, 'Неизвестная команда')
-            
-            send_data = {
-                'chat_id': chat_id,
-                'text': response_text,
-                'parse_mode': 'Markdown'
-            }
-            
-            if callback_data == 'order_card':
-                send_data['reply_markup'] = {
-                    'inline_keyboard': [[
-                        {
-                            'text': '🔗 Оформить карту',
-                            'url': 'https://alfa.me/ASQWHN'
-                        }
-                    ]]
-                }
-            
-            send_url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
-            req_data = json.dumps(send_data).encode('utf-8')
-            req = urllib.request.Request(
-                send_url,
-                data=req_data,
-                headers={'Content-Type': 'application/json'}
-            )
-            
-            try:
-                with urllib.request.urlopen(req) as response:
-                    response.read()
-            except Exception:
-                pass
-            
-            if callback_query.get('id'):
-                answer_url = f'https://api.telegram.org/bot{bot_token}/answerCallbackQuery'
-                answer_data = json.dumps({'callback_query_id': callback_query['id']}).encode('utf-8')
-                answer_req = urllib.request.Request(
-                    answer_url,
-                    data=answer_data,
-                    headers={'Content-Type': 'application/json'}
-                )
-                try:
-                    with urllib.request.urlopen(answer_req) as response:
-                        response.read()
-                except Exception:
-                    pass
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'ok': True})
-        }
-    
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json'},
-        'isBase64Encoded': False,
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+    return router.dispatch(event, context)
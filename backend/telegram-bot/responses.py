@@ -0,0 +1,192 @@
+import os
+import json
+from typing import Dict, Any, Optional
+
+WEB_APP_URL = 'https://alpha-card-project--preview.poehali.dev/'
+CARD_ORDER_URL = 'https://alfa.me/ASQWHN'
+
+START_TEXT = (
+    "👋 Добро пожаловать в реферальную программу Альфа-Банка!\n\n"
+    "🎁 Получите 1000₽ бонусом за оформление карты\n"
+    "💰 Зарабатывайте 200₽ за каждого друга\n\n"
+    "📱 Установите приложение на телефон:\n"
+    "1. Откройте приложение (кнопка ниже)\n"
+    "2. iPhone: Safari → Поделиться → На экран «Домой»\n"
+    "3. Android: Chrome → Меню (⋮) → Установить приложение\n\n"
+    "Нажмите кнопку, чтобы начать! 👇"
+)
+
+START_KEYBOARD = {
+    'inline_keyboard': [
+        [{
+            'text': '🚀 Открыть приложение',
+            'web_app': {'url': WEB_APP_URL}
+        }],
+        [
+            {
+                'text': '💳 Оформить карту',
+                'web_app': {'url': f'{WEB_APP_URL}?page=card-order'}
+            },
+            {
+                'text': '💰 Баланс',
+                'web_app': {'url': WEB_APP_URL}
+            }
+        ],
+        [
+            {
+                'text': '👥 Пригласить друга',
+                'web_app': {'url': f'{WEB_APP_URL}?page=referral'}
+            },
+            {
+                'text': '💸 Вывести деньги',
+                'web_app': {'url': f'{WEB_APP_URL}?page=withdraw'}
+            }
+        ],
+        [{
+            'text': '❓ Помощь',
+            'web_app': {'url': f'{WEB_APP_URL}?page=support'}
+        }],
+        [{
+            'text': '📱 Как установить на телефон?',
+            'callback_data': 'install_guide'
+        }]
+    ]
+}
+
+CALLBACK_TEXTS = {
+    'order_card': (
+        "💳 *Оформление карты Альфа-Банка*\n\n"
+        "🎁 Получите 1000₽ бонусом:\n"
+        "• 500₽ от нас\n"
+        "• 500₽ от Альфа-Банка\n\n"
+        "📝 Инструкция:\n"
+        f"1. Перейдите по ссылке: {CARD_ORDER_URL}\n"
+        "2. Оформите карту\n"
+        "3. Активируйте в приложении\n"
+        "4. Совершите покупку от 200₽\n"
+        "5. Пришлите чек в @Alfa_Bank778\n\n"
+        "✨ Бесплатное обслуживание и кэшбэк!"
+    ),
+    'help': (
+        "❓ *Помощь и поддержка*\n\n"
+        "📱 Telegram: @Alfa_Bank778\n"
+        "📧 Email: support@alfacard.promo\n\n"
+        "🕐 Время работы:\n"
+        "Ежедневно с 9:00 до 21:00 (МСК)\n\n"
+        "Мы всегда готовы помочь вам!"
+    ),
+    'install_guide': (
+        "📱 *Как установить приложение на телефон*\n\n"
+        "🍎 *Для iPhone (iOS):*\n"
+        "1. Откройте приложение через Safari\n"
+        "2. Нажмите кнопку «Поделиться» (↑)\n"
+        "3. Прокрутите вниз и выберите «На экран «Домой»»\n"
+        "4. Нажмите «Добавить»\n\n"
+        "🤖 *Для Android:*\n"
+        "1. Откройте приложение через Chrome\n"
+        "2. Нажмите меню (⋮) в правом верхнем углу\n"
+        "3. Выберите «Установить приложение» или «Добавить на главный экран»\n"
+        "4. Нажмите «Установить»\n\n"
+        "✨ После установки приложение будет работать как обычное приложение с иконкой на главном экране!"
+    )
+}
+
+PERSONALIZED_TEXTS = {
+    'balance': (
+        "💰 *Ваш баланс*\n\n"
+        "Текущий баланс: *{balance} ₽*\n\n"
+        "Чтобы пополнить баланс:\n"
+        "• Оформите карту Альфа-Банка (+500₽)\n"
+        "• Пригласите друзей (+200₽ за каждого)"
+    ),
+    'referral': (
+        "👥 *Реферальная программа*\n\n"
+        "💸 Зарабатывайте 200₽ за каждого друга!\n\n"
+        "Ваша реферальная ссылка:\n"
+        "`{referral_link}`\n\n"
+        "Как это работает:\n"
+        "1. Отправьте ссылку другу\n"
+        "2. Друг регистрируется и оформляет карту\n"
+        "3. Вы оба получаете бонусы!\n\n"
+        "Приглашено друзей: *{referral_count}*"
+    ),
+    'withdraw': (
+        "💸 *Вывод средств*\n\n"
+        "Доступно к выводу: *{balance} ₽*\n\n"
+        "Вывод осуществляется через СБП (Систему Быстрых Платежей) "
+        "на любой банк без комиссии.\n\n"
+        "Откройте приложение для оформления заявки на вывод."
+    ),
+}
+
+BOT_USERNAME = os.environ.get('TELEGRAM_BOT_USERNAME', '')
+REFERRAL_LINK = f'https://t.me/{BOT_USERNAME}?start={{code}}' if BOT_USERNAME else 'https://alfacard.promo/ref/{code}'
+NO_REFERRAL_LINK = 'откройте приложение, чтобы получить ссылку'
+
+UNKNOWN_TEXT = 'Неизвестная команда'
+UNAVAILABLE_TEXT = 'Сервис временно недоступен, попробуйте чуть позже 🙏'
+
+CALLBACK_KEYBOARDS = {
+    'order_card': {
+        'inline_keyboard': [[
+            {
+                'text': '🔗 Оформить карту',
+                'url': CARD_ORDER_URL
+            }
+        ]]
+    }
+}
+
+
+def prepare(payload: Dict[str, Any]) -> bytes:
+    '''
+    Business: Сериализует статическую часть sendMessage один раз при импорте
+    Args: параметры сообщения без chat_id
+    Returns: JSON-объект в байтах, к которому подставляется chat_id
+    '''
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def render(template: bytes, chat_id: int) -> bytes:
+    return b'{"chat_id":%d,%s' % (int(chat_id), template[1:])
+
+
+COMMANDS: Dict[str, bytes] = {
+    '/start': prepare({'text': START_TEXT, 'reply_markup': START_KEYBOARD}),
+}
+
+CALLBACKS: Dict[str, bytes] = {
+    name: prepare({
+        'text': text,
+        'parse_mode': 'Markdown',
+        **({'reply_markup': CALLBACK_KEYBOARDS[name]} if name in CALLBACK_KEYBOARDS else {})
+    })
+    for name, text in CALLBACK_TEXTS.items()
+}
+
+UNKNOWN_CALLBACK = prepare({'text': UNKNOWN_TEXT, 'parse_mode': 'Markdown'})
+UNAVAILABLE = prepare({'text': UNAVAILABLE_TEXT})
+
+
+def format_rub(value: Any) -> str:
+    return f'{value:.2f}'.rstrip('0').rstrip('.')
+
+
+def render_personalized(name: str, chat_id: int, user: Optional[Dict[str, Any]]) -> bytes:
+    '''
+    Business: Собирает ответ с данными пользователя (баланс, реферальная ссылка)
+    Args: имя callback, chat_id, данные пользователя или None, если он ещё не открывал приложение
+    Returns: готовое тело запроса sendMessage
+    '''
+    user = user or {}
+    code = user.get('referral_code')
+    text = PERSONALIZED_TEXTS[name].format(
+        balance=format_rub(user.get('balance', 0)),
+        referral_link=REFERRAL_LINK.format(code=code) if code else NO_REFERRAL_LINK,
+        referral_count=user.get('referral_count', 0),
+    )
+    return json.dumps(
+        {'chat_id': chat_id, 'text': text, 'parse_mode': 'Markdown'},
+        ensure_ascii=False,
+        separators=(',', ':'),
+    ).encode('utf-8')
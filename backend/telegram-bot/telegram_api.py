@@ -0,0 +1,202 @@
+import os
+import json
+import http.client
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import tracing
+
+API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+CONNECT_TIMEOUT = float(os.environ.get('TELEGRAM_CONNECT_TIMEOUT', '3'))
+READ_TIMEOUT = float(os.environ.get('TELEGRAM_READ_TIMEOUT', '5'))
+MAX_CONNECTIONS = int(os.environ.get('TELEGRAM_MAX_CONNECTIONS', '4'))
+
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class BotApiError(Exception):
+    def __init__(self, method: str, status: int, description: str, retry_after: float = 0.0) -> None:
+        super().__init__(f'{method}: {description}')
+        self.method = method
+        self.status = status
+        self.description = description
+        self.retry_after = retry_after
+
+
+class BotApiClient:
+    '''
+    Business: Клиент Bot API с keep-alive соединениями, переживающими тёплые вызовы
+    Args: токен бота, базовый URL API, таймауты соединения и чтения
+    '''
+
+    def __init__(self, token: str, api_url: str = API_URL, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, max_connections: int = MAX_CONNECTIONS) -> None:
+        url = urlsplit(api_url)
+        self.scheme = url.scheme
+        self.host = url.hostname or ''
+        self.port = url.port
+        self.path_prefix = f"{url.path.rstrip('/')}/bot{token}/"
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_connections = max_connections
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _connection(self) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        conn = connection_class(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn, False
+
+    def _release(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if len(self._idle) < self.max_connections:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _request(self, method: str, body: bytes) -> Tuple[int, bytes]:
+        while True:
+            conn, reused = self._connection()
+            try:
+                conn.request('POST', self.path_prefix + method, body, {
+                    'Content-Type': 'application/json',
+                    'Connection': 'keep-alive',
+                })
+                response = conn.getresponse()
+                data = response.read()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            return response.status, data
+
+    def _record(self, method: str, started: float, error: bool) -> None:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            stats = self._stats.setdefault(method, {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+    def call(self, method: str, payload: Union[Dict[str, Any], bytes]) -> Any:
+        '''
+        Business: Вызов метода Bot API
+        Args: имя метода, параметры (dict или уже сериализованный JSON)
+        Returns: поле result из ответа Telegram, при ошибке BotApiError
+        '''
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+        started = time.perf_counter()
+        try:
+            with tracing.span(f'tg.{method}'):
+                status, data = self._request(method, body)
+        except Exception as e:
+            self._record(method, started, True)
+            raise BotApiError(method, 0, f'{type(e).__name__}: {e}') from e
+        try:
+            decoded = json.loads(data)
+        except ValueError:
+            decoded = {'ok': False, 'description': f'HTTP {status}'}
+        if not decoded.get('ok'):
+            self._record(method, started, True)
+            retry_after = float(decoded.get('parameters', {}).get('retry_after', 0))
+            raise BotApiError(method, status, decoded.get('description', f'HTTP {status}'), retry_after)
+        self._record(method, started, False)
+        return decoded.get('result')
+
+    def call_many(self, calls: List[Tuple[str, Union[Dict[str, Any], bytes]]]) -> List[Any]:
+        '''
+        Business: Параллельный вызов нескольких методов Bot API
+        Returns: результаты в порядке вызовов; на месте упавших вызовов - BotApiError
+        '''
+        results: List[Any] = [None] * len(calls)
+
+        def run(index: int) -> None:
+            method, payload = calls[index]
+            try:
+                results[index] = self.call(method, payload)
+            except BotApiError as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=tracing.bind(run), args=(i,)) for i in range(1, len(calls))]
+        for thread in threads:
+            thread.start()
+        if calls:
+            run(0)
+        for thread in threads:
+            thread.join()
+        return results
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {method: dict(stats) for method, stats in self._stats.items()}
+
+
+class RateLimiter:
+    '''
+    Business: Ограничение частоты отправки по лимитам Telegram (глобально и на чат)
+    Args: сообщений в секунду глобально, минимальный интервал для одного чата
+    '''
+
+    def __init__(self, global_rate: float = 30.0, per_chat_interval: float = 1.0) -> None:
+        self.global_interval = 1.0 / global_rate
+        self.per_chat_interval = per_chat_interval
+        self._next_global = 0.0
+        self._next_by_chat: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._next_global = max(self._next_global, time.monotonic() + seconds)
+
+    def wait(self, chat_id: int, deadline: Optional[float] = None) -> bool:
+        '''
+        Business: Ждёт слота отправки в чат
+        Args: chat_id, момент time.monotonic(), позже которого слот не нужен
+        Returns: False сразу и без занятия слота, если слот наступает позже deadline
+        '''
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_global, self._next_by_chat.get(chat_id, 0.0))
+            if deadline is not None and slot > deadline:
+                return False
+            self._next_global = slot + self.global_interval
+            self._next_by_chat[chat_id] = slot + self.per_chat_interval
+            if len(self._next_by_chat) > 10000:
+                self._next_by_chat = {c: t for c, t in self._next_by_chat.items() if t > now}
+        if slot > now:
+            time.sleep(slot - now)
+        return True
+
+
+_clients: Dict[str, BotApiClient] = {}
+
+
+def get_client(token: Optional[str] = None) -> BotApiClient:
+    token = token if token is not None else os.environ.get('TELEGRAM_BOT_TOKEN', '')
+    client = _clients.get(token)
+    if client is None:
+        client = _clients.setdefault(token, BotApiClient(token))
+        tracing.register('telegram_api', client.stats)
+    return client
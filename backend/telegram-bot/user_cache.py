@@ -0,0 +1,56 @@
+import os
+from typing import Dict, Any, Optional
+
+from change_cache import CACHE_LISTEN, CHANGES_CHANNEL, MISSING, ChangeListener, TTLCache
+from db import connection
+import tracing
+
+CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '30'))
+CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', '10000'))
+
+USER_SQL = '''
+    SELECT balance, referral_code, referral_count
+    FROM users
+    WHERE telegram_id = %s
+'''
+
+cache = TTLCache(CACHE_TTL, CACHE_MAX_SIZE)
+listener = ChangeListener(
+    CHANGES_CHANNEL,
+    lambda payload: cache.invalidate(int(payload)),
+    cache.clear,
+)
+
+
+def load_user(telegram_id: int) -> Optional[Dict[str, Any]]:
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(USER_SQL, (telegram_id,))
+            row = cur.fetchone()
+        conn.rollback()
+    if not row:
+        return None
+    balance, referral_code, referral_count = row
+    return {'balance': balance, 'referral_code': referral_code, 'referral_count': referral_count}
+
+
+def get_user(telegram_id: int) -> Optional[Dict[str, Any]]:
+    '''
+    Business: Read-through чтение пользователя для ответов бота
+    Args: telegram_id
+    Returns: balance, referral_code, referral_count или None, если пользователя нет
+    '''
+    if CACHE_LISTEN and not listener.poll():
+        return load_user(telegram_id)
+    user = cache.get(telegram_id)
+    if user is MISSING:
+        user = load_user(telegram_id)
+        cache.put(telegram_id, user)
+    return user
+
+
+def cache_stats() -> Dict[str, Any]:
+    return cache.stats()
+
+
+tracing.register('user_cache', cache_stats)
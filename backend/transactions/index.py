@@ -0,0 +1,43 @@
+from typing import Dict, Any
+
+from db import connection
+from ledger import STATEMENT_PAGE_SIZE, statement
+from runtime import HttpError, Router, json_response, query_params
+from telegram_auth import authenticate
+
+router = Router(default_method='GET')
+
+MAX_PAGE_SIZE = 200
+
+
+@router.route('GET')
+def get_transactions(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    params = query_params(event)
+    try:
+        before_id = int(params['before']) if params.get('before') else None
+        limit = int(params.get('limit') or STATEMENT_PAGE_SIZE)
+    except ValueError:
+        raise HttpError(400, 'before and limit must be integers')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HttpError(400, f'limit must be from 1 to {MAX_PAGE_SIZE}')
+    
+    telegram_id = authenticate(event, params.get('telegram_id'))['telegram_id']
+    
+    with connection() as conn:
+        with conn.cursor() as cur:
+            items = statement(cur, telegram_id, before_id, limit)
+        conn.rollback()
+    
+    return json_response(200, {
+        'items': items,
+        'next_before': items[-1]['id'] if len(items) == limit else None
+    })
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Выписка по балансу пользователя из журнала операций
+    Args: event с X-Telegram-Init-Data, before (id последней записи предыдущей страницы), limit
+    Returns: HTTP response со страницей операций и курсором следующей страницы
+    '''
+    return router.dispatch(event, context)
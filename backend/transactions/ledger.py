@@ -0,0 +1,52 @@
+from typing import Dict, Any, List, Optional
+
+STATEMENT_PAGE_SIZE = 50
+
+
+def posting_ctes(source_sql: str, extra_assignments: str = '') -> str:
+    '''
+    Business: CTE проводки - запись в журнал и изменение users.balance в одном запросе
+    Args: SELECT, возвращающий (telegram_id, amount, kind, idempotency_key); доп. присваивания для users
+    Returns: фрагмент WITH c CTE entries (новые записи) и credited (новые балансы)
+    '''
+    extra = f', {extra_assignments}' if extra_assignments else ''
+    return f'''
+    entries AS (
+        INSERT INTO balance_transactions (telegram_id, amount, kind, idempotency_key)
+        {source_sql}
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING telegram_id, amount, kind
+    ), credited AS (
+        UPDATE users u
+        SET balance = u.balance + e.amount, updated_at = CURRENT_TIMESTAMP{extra}
+        FROM (
+            SELECT telegram_id, SUM(amount) AS amount, array_agg(kind) AS kinds
+            FROM entries
+            GROUP BY telegram_id
+        ) e
+        WHERE u.telegram_id = e.telegram_id
+        RETURNING u.telegram_id, u.balance, e.kinds, pg_notify('users_changed', u.telegram_id::text)
+    )'''
+
+
+STATEMENT_SQL = '''
+    SELECT id, amount, kind, created_at
+    FROM balance_transactions
+    WHERE telegram_id = %(telegram_id)s AND (%(before_id)s::bigint IS NULL OR id < %(before_id)s)
+    ORDER BY id DESC
+    LIMIT %(limit)s
+'''
+
+
+def statement(cur: Any, telegram_id: int, before_id: Optional[int] = None,
+              limit: int = STATEMENT_PAGE_SIZE) -> List[Dict[str, Any]]:
+    '''
+    Business: Страница выписки по балансу (keyset-пагинация по id)
+    Args: курсор, telegram_id, id последней записи предыдущей страницы, размер страницы
+    Returns: записи журнала от новых к старым
+    '''
+    cur.execute(STATEMENT_SQL, {'telegram_id': telegram_id, 'before_id': before_id, 'limit': limit})
+    return [
+        {'id': row_id, 'amount': amount, 'kind': kind, 'created_at': created_at}
+        for row_id, amount, kind, created_at in cur.fetchall()
+    ]
@@ -0,0 +1,217 @@
+import os
+import hmac
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from db import connection
+from ledger import posting_ctes
+from payouts import (COMPLETED, FAILED, PAYOUT_TIMEOUT, RETRY, PayoutBackend, PayoutResult, Withdrawal,
+                     get_backend)
+from runtime import HttpError, Router, header, json_response
+import tracing
+
+BATCH_SIZE = int(os.environ.get('WITHDRAW_BATCH_SIZE', '50'))
+CONCURRENCY = int(os.environ.get('WITHDRAW_CONCURRENCY', '4'))
+MAX_ATTEMPTS = int(os.environ.get('WITHDRAW_MAX_ATTEMPTS', '5'))
+LEASE_SECONDS = int(os.environ.get('WITHDRAW_LEASE_SECONDS', '120'))
+TIME_BUDGET = float(os.environ.get('WITHDRAW_TIME_BUDGET', '20'))
+RETRY_DELAY = 60
+SKIPPED = 'skipped'
+
+if LEASE_SECONDS < TIME_BUDGET + 2 * PAYOUT_TIMEOUT:
+    raise ValueError('WITHDRAW_LEASE_SECONDS must exceed WITHDRAW_TIME_BUDGET plus two PAYOUT_TIMEOUT')
+
+CLAIM_SQL = '''
+    UPDATE withdrawals
+    SET status = 'processing', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP,
+        available_at = CURRENT_TIMESTAMP + make_interval(secs => %(lease)s)
+    WHERE id IN (
+        SELECT id FROM withdrawals
+        WHERE status IN ('pending', 'processing') AND available_at <= CURRENT_TIMESTAMP
+        ORDER BY available_at
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, telegram_id, amount, phone, bank, attempts
+'''
+
+MARK_COMPLETED_SQL = '''
+    WITH done AS (
+        UPDATE withdrawals w
+        SET status = 'completed', payout_id = r.payout_id, last_error = NULL,
+            completed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        FROM unnest(%s::bigint[], %s::text[]) AS r(id, payout_id)
+        WHERE w.id = r.id AND w.status = 'processing'
+        RETURNING w.telegram_id, w.amount
+    )
+    INSERT INTO notification_outbox (chat_id, kind, params)
+    SELECT telegram_id, 'withdrawal_completed', jsonb_build_object('amount', amount)
+    FROM done
+'''
+
+MARK_RETRY_SQL = '''
+    UPDATE withdrawals w
+    SET status = 'pending', last_error = r.error, updated_at = CURRENT_TIMESTAMP,
+        available_at = CURRENT_TIMESTAMP + make_interval(secs => %s * w.attempts)
+    FROM unnest(%s::bigint[], %s::text[]) AS r(id, error)
+    WHERE w.id = r.id AND w.status = 'processing'
+'''
+
+RELEASE_SQL = '''
+    UPDATE withdrawals
+    SET status = 'pending', attempts = attempts - 1, updated_at = CURRENT_TIMESTAMP,
+        available_at = CURRENT_TIMESTAMP
+    WHERE id = ANY(%s::bigint[]) AND status = 'processing'
+'''
+
+MARK_REVIEW_SQL = '''
+    UPDATE withdrawals w
+    SET status = 'needs_review', last_error = r.error, updated_at = CURRENT_TIMESTAMP
+    FROM unnest(%s::bigint[], %s::text[]) AS r(id, error)
+    WHERE w.id = r.id AND w.status = 'processing'
+'''
+
+MARK_FAILED_SQL = '''
+    WITH failed AS (
+        UPDATE withdrawals w
+        SET status = 'failed', last_error = r.error, updated_at = CURRENT_TIMESTAMP
+        FROM unnest(%s::bigint[], %s::text[]) AS r(id, error)
+        WHERE w.id = r.id AND w.status = 'processing'
+        RETURNING w.id, w.telegram_id, w.amount
+    ),''' + posting_ctes('''
+        SELECT telegram_id, amount, 'withdrawal_refund', 'withdrawal_refund:' || id
+        FROM failed
+    ''') + '''
+    INSERT INTO notification_outbox (chat_id, kind, params)
+    SELECT f.telegram_id, 'withdrawal_failed', jsonb_build_object('amount', f.amount, 'balance', c.balance)
+    FROM failed f
+    JOIN credited c ON c.telegram_id = f.telegram_id
+'''
+
+QUEUE_SQL = '''
+    SELECT COUNT(*), EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - MIN(created_at))
+    FROM withdrawals
+    WHERE status IN ('pending', 'processing')
+'''
+
+router = Router(allow_headers='Content-Type, X-Admin-Token')
+backend: Optional[PayoutBackend] = get_backend()
+executor = ThreadPoolExecutor(max_workers=CONCURRENCY)
+
+
+def require_admin(event: Dict[str, Any]) -> None:
+    admin_token = os.environ.get('WITHDRAW_ADMIN_TOKEN', '')
+    if not admin_token:
+        raise HttpError(403, 'Withdraw admin token is not configured')
+    if not hmac.compare_digest(header(event, 'X-Admin-Token').encode('utf-8'), admin_token.encode('utf-8')):
+        raise HttpError(403, 'Forbidden')
+
+
+def claim(limit: int) -> List[Withdrawal]:
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CLAIM_SQL, {'lease': LEASE_SECONDS, 'limit': limit})
+            rows = cur.fetchall()
+        conn.commit()
+    return [Withdrawal(*row) for row in rows]
+
+
+def settle(results: List[Tuple[Withdrawal, PayoutResult]]) -> Dict[str, int]:
+    '''
+    Business: Фиксирует результаты выплат; сумма возвращается на баланс только при явном отказе партнёра,
+              исчерпанные повторы уходят на ручную проверку - выплата могла пройти
+    Args: пары (заявка, результат выплаты)
+    Returns: количество выполненных, отложенных, отклонённых, отправленных на проверку и возвращённых в очередь
+    '''
+    released = [w.id for w, r in results if r.status == SKIPPED]
+    completed = [(w.id, r.payout_id) for w, r in results if r.status == COMPLETED]
+    retried = [(w.id, r.error) for w, r in results if r.status == RETRY and w.attempts < MAX_ATTEMPTS]
+    review = [(w.id, r.error) for w, r in results if r.status == RETRY and w.attempts >= MAX_ATTEMPTS]
+    failed = [(w.id, r.error) for w, r in results if r.status == FAILED]
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            if released:
+                cur.execute(RELEASE_SQL, (released,))
+            if completed:
+                ids, payout_ids = zip(*completed)
+                cur.execute(MARK_COMPLETED_SQL, (list(ids), list(payout_ids)))
+            if retried:
+                ids, errors = zip(*retried)
+                cur.execute(MARK_RETRY_SQL, (RETRY_DELAY, list(ids), list(errors)))
+            if review:
+                ids, errors = zip(*review)
+                cur.execute(MARK_REVIEW_SQL, (list(ids), list(errors)))
+            if failed:
+                ids, errors = zip(*failed)
+                cur.execute(MARK_FAILED_SQL, (list(ids), list(errors)))
+        conn.commit()
+
+    return {'completed': len(completed), 'retried': len(retried), 'failed': len(failed), 'needs_review': len(review),
+            'released': len(released)}
+
+
+def queue_stats() -> Dict[str, Any]:
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(QUEUE_SQL)
+            depth, oldest_age = cur.fetchone()
+        conn.rollback()
+    return {'queue_depth': depth, 'oldest_age': round(float(oldest_age or 0), 1)}
+
+
+def pay_before(deadline: float) -> Callable[[Withdrawal], PayoutResult]:
+    '''
+    Business: Выплата, которая не начинается, если может не успеть до конца бюджета времени - такая заявка
+              возвращается в очередь, а не остаётся в processing до истечения аренды
+    Args: момент окончания бюджета (time.monotonic)
+    Returns: функция выплаты одной заявки
+    '''
+    def pay(withdrawal: Withdrawal) -> PayoutResult:
+        if time.monotonic() + PAYOUT_TIMEOUT > deadline:
+            return PayoutResult(SKIPPED)
+        return backend.pay(withdrawal)
+    return tracing.bind(pay)
+
+
+def drain(deadline: float) -> Dict[str, int]:
+    stats = {'claimed': 0, 'completed': 0, 'retried': 0, 'failed': 0, 'needs_review': 0, 'released': 0}
+    pay = pay_before(deadline)
+    while time.monotonic() + PAYOUT_TIMEOUT <= deadline:
+        batch = claim(BATCH_SIZE)
+        if not batch:
+            break
+        stats['claimed'] += len(batch)
+        results = list(zip(batch, executor.map(pay, batch)))
+        for key, value in settle(results).items():
+            stats[key] += value
+    return stats
+
+
+@router.route('POST')
+def process_queue(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    require_admin(event)
+    if backend is None:
+        raise HttpError(503, 'Payout backend is not configured')
+    started = time.monotonic()
+    stats: Dict[str, Any] = drain(started + TIME_BUDGET)
+    duration = time.monotonic() - started
+    stats['duration'] = round(duration, 3)
+    stats['throughput'] = round(stats['claimed'] / duration, 2) if duration else 0.0
+    return json_response(200, {**stats, **queue_stats()})
+
+
+@router.route('GET')
+def get_queue_stats(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    require_admin(event)
+    return json_response(200, queue_stats())
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Пакетная обработка очереди заявок на вывод (запуск по таймеру или POST)
+    Args: event - вызов по расписанию или HTTP POST, GET - состояние очереди; оба с X-Admin-Token
+    Returns: HTTP response с пропускной способностью, глубиной и возрастом очереди
+    '''
+    return router.dispatch(event, context)
@@ -0,0 +1,118 @@
+import os
+import json
+import threading
+import urllib.error
+import urllib.request
+from decimal import Decimal
+from typing import Dict, NamedTuple, Optional
+
+import tracing
+
+PAYOUT_TIMEOUT = float(os.environ.get('PAYOUT_TIMEOUT', '10'))
+
+
+class Withdrawal(NamedTuple):
+    id: int
+    telegram_id: int
+    amount: Decimal
+    phone: str
+    bank: str
+    attempts: int
+
+    @property
+    def idempotency_key(self) -> str:
+        return f'withdrawal:{self.id}'
+
+
+class PayoutResult(NamedTuple):
+    status: str
+    payout_id: Optional[str] = None
+    error: str = ''
+
+
+COMPLETED = 'completed'
+RETRY = 'retry'
+FAILED = 'failed'
+
+
+class PayoutBackend:
+    '''
+    Business: Интерфейс провайдера выплат по СБП
+    Returns: COMPLETED, FAILED только при явном отказе (выплаты точно не было), RETRY - исход неизвестен
+    '''
+
+    def pay(self, withdrawal: Withdrawal) -> PayoutResult:
+        raise NotImplementedError
+
+
+class FakePayoutBackend(PayoutBackend):
+    '''
+    Business: Локальный провайдер выплат для тестов и разработки
+    Args: номера телефонов, по которым выплата отклоняется или временно не проходит
+    '''
+
+    def __init__(self, failing_phones: frozenset = frozenset(), flaky_phones: frozenset = frozenset()) -> None:
+        self.failing_phones = failing_phones
+        self.flaky_phones = flaky_phones
+        self.payouts: Dict[str, Withdrawal] = {}
+        self._lock = threading.Lock()
+
+    def pay(self, withdrawal: Withdrawal) -> PayoutResult:
+        if withdrawal.phone in self.failing_phones:
+            return PayoutResult(FAILED, error='Recipient rejected by bank')
+        if withdrawal.phone in self.flaky_phones:
+            return PayoutResult(RETRY, error='Bank is temporarily unavailable')
+        with self._lock:
+            self.payouts.setdefault(withdrawal.idempotency_key, withdrawal)
+        return PayoutResult(COMPLETED, payout_id=f'fake-{withdrawal.id}')
+
+
+class HttpPayoutBackend(PayoutBackend):
+    '''
+    Business: Выплата через HTTP API платёжного партнёра с ключом идемпотентности
+    Args: URL метода выплаты, токен доступа
+    '''
+
+    def __init__(self, url: str, token: str) -> None:
+        self.url = url
+        self.token = token
+
+    def pay(self, withdrawal: Withdrawal) -> PayoutResult:
+        req = urllib.request.Request(
+            self.url,
+            data=json.dumps({
+                'amount': str(withdrawal.amount),
+                'phone': withdrawal.phone,
+                'bank': withdrawal.bank,
+            }).encode('utf-8'),
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {self.token}',
+                'Idempotency-Key': withdrawal.idempotency_key,
+            }
+        )
+        try:
+            with tracing.span('http.payout'), urllib.request.urlopen(req, timeout=PAYOUT_TIMEOUT) as response:
+                data = json.loads(response.read() or b'{}')
+            return PayoutResult(COMPLETED, payout_id=str(data.get('id', '')))
+        except urllib.error.HTTPError as e:
+            if e.code in (408, 409, 429) or e.code >= 500:
+                return PayoutResult(RETRY, error=f'HTTP {e.code}')
+            return PayoutResult(FAILED, error=f'HTTP {e.code}')
+        except Exception as e:
+            return PayoutResult(RETRY, error=f'{type(e).__name__}: {e}')
+
+
+def get_backend() -> Optional[PayoutBackend]:
+    '''
+    Business: Провайдер выплат из PAYOUT_BACKEND; fake включается только явно, без настройки выплат нет
+    Returns: провайдер или None, если PAYOUT_BACKEND не задан
+    '''
+    name = os.environ.get('PAYOUT_BACKEND', '')
+    if not name:
+        return None
+    if name == 'http':
+        return HttpPayoutBackend(os.environ['PAYOUT_API_URL'], os.environ.get('PAYOUT_API_TOKEN', ''))
+    if name == 'fake':
+        return FakePayoutBackend()
+    raise ValueError(f'Unknown PAYOUT_BACKEND {name}')
@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator, List, Optional
+
+ENABLED = os.environ.get('TRACING_ENABLED', '1') == '1'
+LOG_ENABLED = ENABLED and os.environ.get('TRACING_LOG', '1') == '1'
+MAX_SPANS = 50
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    '''
+    Business: Гистограмма длительностей с фиксированными границами в миллисекундах
+    '''
+
+    __slots__ = ('counts', 'count', 'total_ms', 'max_ms')
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'max_ms': round(self.max_ms, 3),
+            'buckets': {
+                **{f'le_{bound}': count for bound, count in zip(BUCKETS_MS, self.counts)},
+                'le_inf': self.counts[-1],
+            },
+        }
+
+
+class Trace:
+    '''
+    Business: Спаны одного вызова функции: подключение к базе, запросы, вызовы внешних HTTP API
+    '''
+
+    __slots__ = ('started', 'spans', 'breakdown', 'lock')
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.spans: List[List[Any]] = []
+        self.breakdown: Dict[str, List[float]] = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, ms: float) -> None:
+        with self.lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append([name, round(ms, 3)])
+            totals = self.breakdown.get(name)
+            if totals is None:
+                self.breakdown[name] = [1, ms]
+            else:
+                totals[0] += 1
+                totals[1] += ms
+
+
+class _NoopSpan:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+
+_NOOP = _NoopSpan()
+_local = threading.local()
+_histograms: Dict[str, Histogram] = {}
+_histograms_lock = threading.Lock()
+_providers: Dict[str, Callable[[], Any]] = {}
+_state = {'cold': True, 'invocations': 0, 'errors': 0}
+
+
+def observe(name: str, ms: float) -> None:
+    with _histograms_lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(ms)
+
+
+def current() -> Optional[Trace]:
+    return getattr(_local, 'trace', None)
+
+
+def activate(trace: Optional[Trace]) -> None:
+    _local.trace = trace
+
+
+def bind(func: Callable) -> Callable:
+    '''
+    Business: Переносит текущий trace в рабочий поток (call_many, пулы потоков выплат и рассылок)
+    '''
+    if not ENABLED:
+        return func
+    trace = current()
+
+    def bound(*args: Any, **kwargs: Any) -> Any:
+        activate(trace)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            activate(None)
+    return bound
+
+
+@contextmanager
+def _span(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - started) * 1000
+        trace = current()
+        if trace is not None:
+            trace.add(name, ms)
+        observe(name, ms)
+
+
+def span(name: str) -> Any:
+    '''
+    Business: Замер участка кода; без TRACING_ENABLED возвращает общий пустой контекстный менеджер
+    Args: имя спана: db.connect, db.query, tg.<метод> и т.д.
+    '''
+    if not ENABLED:
+        return _NOOP
+    return _span(name)
+
+
+def register(name: str, provider: Callable[[], Any]) -> None:
+    '''
+    Business: Регистрирует источник статистики (пул соединений, кэши, лимитеры) для выгрузки метрик
+    '''
+    _providers[name] = provider
+
+
+def begin() -> Optional[Trace]:
+    if not ENABLED:
+        return None
+    trace = Trace()
+    activate(trace)
+    return trace
+
+
+def finish(trace: Optional[Trace], function: str, method: str, status: int,
+           request_id: str, error: Optional[BaseException] = None) -> None:
+    '''
+    Business: Закрывает вызов: гистограммы, одна JSON-строка лога с разбивкой по спанам, флагом cold и классом ошибки
+    '''
+    cold = _state['cold']
+    _state['cold'] = False
+    _state['invocations'] += 1
+    if error is not None:
+        _state['errors'] += 1
+    if trace is None:
+        return
+    activate(None)
+    total_ms = (time.perf_counter() - trace.started) * 1000
+    observe(f'request.{method}', total_ms)
+    if not LOG_ENABLED:
+        return
+    record = {
+        'function': function,
+        'method': method,
+        'status': status,
+        'duration_ms': round(total_ms, 3),
+        'cold': cold,
+        'request_id': request_id,
+        'breakdown': {name: {'count': int(c), 'ms': round(ms, 3)} for name, (c, ms) in trace.breakdown.items()},
+        'spans': trace.spans,
+    }
+    if error is not None:
+        record['error_class'] = type(error).__name__
+        record['error'] = str(error)[:500]
+    sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+
+def metrics() -> Dict[str, Any]:
+    '''
+    Business: Снимок метрик инстанса по запросу: гистограммы спанов и статистика зарегистрированных компонентов
+    '''
+    with _histograms_lock:
+        histograms = {name: histogram.snapshot() for name, histogram in _histograms.items()}
+    stats = {}
+    for name, provider in list(_providers.items()):
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            stats[name] = {'error_class': type(e).__name__}
+    return {
+        'enabled': ENABLED,
+        'invocations': _state['invocations'],
+        'errors': _state['errors'],
+        'histograms': histograms,
+        'stats': stats,
+    }
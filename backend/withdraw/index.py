@@ -0,0 +1,124 @@
+import os
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Any, Optional
+
+import psycopg2.errors
+
+from db import connection
+from ledger import posting_ctes
+from runtime import HttpError, Router, json_response, parse_json_body
+from telegram_auth import authenticate
+
+router = Router()
+
+MIN_WITHDRAWAL = Decimal(os.environ.get('MIN_WITHDRAWAL', '100'))
+MAX_WITHDRAWAL = Decimal(os.environ.get('MAX_WITHDRAWAL', '100000'))
+
+SUPPORTED_BANKS = frozenset({
+    'sber', 'tinkoff', 'alfa', 'vtb', 'raif', 'otkrytie', 'gazprom',
+    'psb', 'rosbank', 'sovkom', 'mts', 'akbars', 'unicredit',
+})
+
+PHONE_RE = re.compile(r'^[78](\d{10})$')
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+CREATE_WITHDRAWAL_SQL = '''
+    WITH request AS (
+        INSERT INTO withdrawals (telegram_id, amount, phone, bank, idempotency_key)
+        SELECT %(telegram_id)s, %(amount)s, %(phone)s, %(bank)s, %(idempotency_key)s
+        WHERE EXISTS (SELECT 1 FROM users WHERE telegram_id = %(telegram_id)s)
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING id, telegram_id, amount, status
+    ),''' + posting_ctes('''
+        SELECT telegram_id, -amount, 'withdrawal', 'withdrawal:' || id
+        FROM request
+    ''') + '''
+    SELECT r.id, r.status, r.amount, c.balance
+    FROM request r
+    JOIN credited c ON c.telegram_id = r.telegram_id
+'''
+
+EXISTING_WITHDRAWAL_SQL = '''
+    SELECT w.id, w.status, w.amount, u.balance
+    FROM withdrawals w
+    JOIN users u ON u.telegram_id = w.telegram_id
+    WHERE w.idempotency_key = %s
+'''
+
+
+def normalize_phone(phone: str) -> Optional[str]:
+    match = PHONE_RE.match(re.sub(r'\D', '', phone or ''))
+    return f'+7{match.group(1)}' if match else None
+
+
+def parse_amount(value: Any) -> Optional[Decimal]:
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return None
+    if not amount.is_finite() or amount != amount.quantize(Decimal('0.01')):
+        return None
+    return amount
+
+
+@router.route('POST')
+def create_withdrawal(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    body_data = parse_json_body(event)
+    telegram_id = authenticate(event, body_data.get('telegram_id'))['telegram_id']
+    amount = parse_amount(body_data.get('amount'))
+    phone = normalize_phone(body_data.get('phone', ''))
+    bank = body_data.get('bank')
+    request_id = str(body_data.get('request_id', ''))
+
+    if not REQUEST_ID_RE.match(request_id):
+        raise HttpError(400, 'request_id is required')
+    if amount is None or not MIN_WITHDRAWAL <= amount <= MAX_WITHDRAWAL:
+        raise HttpError(400, f'amount must be between {MIN_WITHDRAWAL} and {MAX_WITHDRAWAL}')
+    if not phone:
+        raise HttpError(400, 'phone must be a Russian mobile number')
+    if bank not in SUPPORTED_BANKS:
+        raise HttpError(400, 'bank is not supported')
+
+    idempotency_key = f'withdraw:{telegram_id}:{request_id}'
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            try:
+                cur.execute(CREATE_WITHDRAWAL_SQL, {
+                    'telegram_id': telegram_id,
+                    'amount': amount,
+                    'phone': phone,
+                    'bank': bank,
+                    'idempotency_key': idempotency_key,
+                })
+            except psycopg2.errors.CheckViolation:
+                conn.rollback()
+                raise HttpError(400, 'Insufficient funds')
+            result = cur.fetchone()
+
+            if not result:
+                cur.execute(EXISTING_WITHDRAWAL_SQL, (idempotency_key,))
+                result = cur.fetchone()
+        conn.commit()
+
+    if not result:
+        raise HttpError(404, 'User not found')
+
+    withdrawal_id, status, reserved, balance = result
+
+    return json_response(200, {
+        'withdrawal_id': withdrawal_id,
+        'status': status,
+        'amount': reserved,
+        'balance': balance
+    })
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Заявка на вывод средств через СБП с резервированием суммы на балансе
+    Args: event с X-Telegram-Init-Data, amount, phone, bank, request_id (ключ идемпотентности)
+    Returns: HTTP response с номером заявки и остатком баланса
+    '''
+    return router.dispatch(event, context)
@@ -0,0 +1,432 @@
+'''
+Business: Нагрузочный прогон handler() функций backend/ на локальном Postgres и заглушке Bot API
+Args: --database-url (отдельная база, данные будут записаны), --migrate, --scenarios, --requests,
+      --concurrency, --output, --baseline/--max-regression для проверки регрессий перед выкладкой
+Returns: JSON: пропускная способность, p50/p95/p99, обращений к базе и выделений памяти на запрос
+
+Сценарии:
+  balance-read    - get-balance для уже созданных пользователей (подписанный initData)
+  balance-create  - get-balance для новых пользователей (INSERT)
+  activate-burst  - activate-card, каждый пользователь активируется двумя одновременными запросами
+  webhook-mix     - telegram-bot: /start, /start <код>, callback-кнопки и повторные доставки update
+'''
+import argparse
+import glob
+import hashlib
+import hmac
+import importlib
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Callable, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import psycopg2
+import psycopg2.extensions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, 'backend')
+MIGRATIONS = os.path.join(ROOT, 'db_migrations')
+
+BOT_TOKEN = 'benchmark:token'
+ADMIN_ID = 1
+USER_ID_BASE = 7_000_000_000
+
+Event = Dict[str, Any]
+
+
+class RoundTrips(threading.local):
+    count = 0
+
+
+round_trips = RoundTrips()
+
+
+class CountingCursor:
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        round_trips.count += 1
+        return super().execute(query, vars)
+
+    def executemany(self, query: Any, vars_list: Any) -> Any:
+        round_trips.count += 1
+        return super().executemany(query, vars_list)
+
+
+class CountingConnection:
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = counting_class(CountingCursor, self.cursor_factory or psycopg2.extensions.cursor)
+
+    def commit(self) -> None:
+        if self.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            round_trips.count += 1
+        super().commit()
+
+    def rollback(self) -> None:
+        if self.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            round_trips.count += 1
+        super().rollback()
+
+
+_counting_classes: Dict[Tuple[type, type], type] = {}
+
+
+def counting_class(mixin: type, base: type) -> type:
+    '''
+    Business: Счётчик поверх фабрики, которую передал db.py (например, TracedConnection), а не вместо неё
+    '''
+    cls = _counting_classes.get((mixin, base))
+    if cls is None:
+        cls = _counting_classes[(mixin, base)] = type(f'{mixin.__name__}{base.__name__}', (mixin, base), {})
+    return cls
+
+
+_connect = psycopg2.connect
+
+
+def counting_connect(*args: Any, **kwargs: Any) -> Any:
+    base = kwargs.get('connection_factory') or psycopg2.extensions.connection
+    kwargs['connection_factory'] = counting_class(CountingConnection, base)
+    return _connect(*args, **kwargs)
+
+
+class StubTelegram(BaseHTTPRequestHandler):
+    '''
+    Business: Заглушка Bot API: отвечает ok с заданной задержкой и считает вызовы
+    '''
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.0
+    calls = 0
+    lock = threading.Lock()
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with StubTelegram.lock:
+            StubTelegram.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        body = b'{"ok":true,"result":true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def start_stub_telegram(latency_ms: float) -> str:
+    StubTelegram.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubTelegram)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def sign_init_data(user: Dict[str, Any], start_param: str = '') -> str:
+    fields = {
+        'auth_date': str(int(time.time())),
+        'query_id': f'bench{user["id"]}',
+        'user': json.dumps(user, ensure_ascii=False, separators=(',', ':')),
+    }
+    if start_param:
+        fields['start_param'] = start_param
+    data_check_string = '\n'.join(f'{k}={fields[k]}' for k in sorted(fields))
+    secret = hmac.new(b'WebAppData', BOT_TOKEN.encode('utf-8'), hashlib.sha256).digest()
+    fields['hash'] = hmac.new(secret, data_check_string.encode('utf-8'), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def load_handler(function: str) -> Callable[[Event, Any], Dict[str, Any]]:
+    '''
+    Business: Импорт index.handler функции так, как его загружает платформа - со своими db.py, runtime.py и т.д.
+    '''
+    function_dir = os.path.join(BACKEND, function)
+    local_modules = {os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(function_dir, '*.py'))}
+    for name in local_modules:
+        sys.modules.pop(name, None)
+    sys.path.insert(0, function_dir)
+    try:
+        module = importlib.import_module('index')
+    finally:
+        sys.path.remove(function_dir)
+        for name in local_modules:
+            sys.modules.pop(name, None)
+    return module.handler
+
+
+def migrate(database_url: str) -> None:
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('users') IS NOT NULL")
+            if cur.fetchone()[0]:
+                return
+            for path in sorted(glob.glob(os.path.join(MIGRATIONS, 'V*.sql'))):
+                with open(path, encoding='utf-8') as f:
+                    cur.execute(f.read())
+
+
+def seed_users(database_url: str, first_id: int, count: int) -> None:
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute('''
+                INSERT INTO users (telegram_id, first_name, referral_code, card_ordered, card_status)
+                SELECT g, 'Bench', 'B' || g, TRUE, 'ordered'
+                FROM generate_series(%s::bigint, %s::bigint) g
+                ON CONFLICT (telegram_id) DO NOTHING
+            ''', (first_id, first_id + count - 1))
+
+
+def next_user_block(database_url: str) -> int:
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute('SELECT GREATEST(MAX(telegram_id) + 1, %s) FROM users', (USER_ID_BASE,))
+            return cur.fetchone()[0]
+
+
+def balance_event(telegram_id: int) -> Event:
+    init_data = sign_init_data({'id': telegram_id, 'first_name': 'Bench'})
+    return {'httpMethod': 'GET', 'headers': {'X-Telegram-Init-Data': init_data}, 'queryStringParameters': {}}
+
+
+def activate_event(telegram_id: int, admin_init_data: str) -> Event:
+    return {
+        'httpMethod': 'POST',
+        'headers': {'X-Telegram-Init-Data': admin_init_data},
+        'body': json.dumps({'telegram_id': telegram_id}),
+    }
+
+
+def webhook_events(rng: random.Random, first_id: int, users: int, count: int) -> List[Event]:
+    events = []
+    update_id = rng.randrange(1, 10 ** 9)
+    for _ in range(count):
+        update_id += 1
+        chat_id = first_id + rng.randrange(users)
+        roll = rng.random()
+        if roll < 0.1 and events:
+            events.append(events[-1])
+            continue
+        if roll < 0.4:
+            text = '/start' if roll < 0.3 else f'/start B{first_id + rng.randrange(users)}'
+            update = {'update_id': update_id, 'message': {
+                'chat': {'id': chat_id}, 'from': {'id': chat_id}, 'text': text,
+            }}
+        else:
+            update = {'update_id': update_id, 'callback_query': {
+                'id': f'cq{update_id}', 'from': {'id': chat_id}, 'message': {'chat': {'id': chat_id}},
+                'data': rng.choice(['balance', 'referral', 'withdraw', 'help', 'order_card', 'install_guide']),
+            }}
+        events.append({'httpMethod': 'POST', 'body': json.dumps(update)})
+    return events
+
+
+def run_requests(handler: Callable, batches: List[List[Event]], concurrency: int) -> Dict[str, Any]:
+    '''
+    Business: Прогон пачек запросов; запросы одной пачки идут одновременно (двойное нажатие)
+    Returns: задержки, обращения к базе, статусы ответов
+    '''
+    latencies: List[float] = []
+    trips: List[int] = []
+    statuses: Dict[int, int] = {}
+    lock = threading.Lock()
+
+    def call(event: Event) -> None:
+        round_trips.count = 0
+        started = time.perf_counter()
+        response = handler(event, None)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            trips.append(round_trips.count)
+            statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+
+    def run_batch(batch: List[Event]) -> None:
+        if len(batch) == 1:
+            call(batch[0])
+            return
+        barrier = threading.Barrier(len(batch))
+
+        def together(event: Event) -> None:
+            barrier.wait()
+            call(event)
+
+        threads = [threading.Thread(target=together, args=(event,)) for event in batch]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    telegram_calls = StubTelegram.calls
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run_batch, batches))
+    wall = time.perf_counter() - started
+
+    requests = len(latencies)
+    return {
+        'requests': requests,
+        'throughput_rps': round(requests / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'db_round_trips_per_request': round(sum(trips) / requests, 3) if requests else 0.0,
+        'telegram_calls_per_request': round((StubTelegram.calls - telegram_calls) / requests, 3) if requests else 0.0,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+    }
+
+
+def measure_allocations(handler: Callable, events: List[Event]) -> Dict[str, float]:
+    '''
+    Business: Память на запрос под tracemalloc - отдельным последовательным проходом, чтобы не искажать задержки
+    '''
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for event in events:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            handler(event, None)
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(after - before)
+    finally:
+        tracemalloc.stop()
+    return {
+        'alloc_peak_kb_per_request': round(statistics.median(peaks) / 1024, 2) if peaks else 0.0,
+        'alloc_retained_kb_per_request': round(statistics.mean(retained) / 1024, 3) if retained else 0.0,
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def scenario_balance_read(args: argparse.Namespace, rng: random.Random) -> Tuple[str, List[List[Event]], List[Event]]:
+    users = max(args.requests // 10, 1)
+    first_id = next_user_block(args.database_url)
+    seed_users(args.database_url, first_id, users)
+    events = [balance_event(first_id + rng.randrange(users)) for _ in range(args.requests + args.alloc_requests)]
+    return 'get-balance', [[e] for e in events[:args.requests]], events[args.requests:]
+
+
+def scenario_balance_create(args: argparse.Namespace, rng: random.Random) -> Tuple[str, List[List[Event]], List[Event]]:
+    first_id = next_user_block(args.database_url)
+    events = [balance_event(first_id + i) for i in range(args.requests + args.alloc_requests)]
+    return 'get-balance', [[e] for e in events[:args.requests]], events[args.requests:]
+
+
+def scenario_activate_burst(args: argparse.Namespace, rng: random.Random) -> Tuple[str, List[List[Event]], List[Event]]:
+    users = args.requests // 2 + args.alloc_requests
+    first_id = next_user_block(args.database_url)
+    seed_users(args.database_url, first_id, users)
+    admin = sign_init_data({'id': ADMIN_ID, 'first_name': 'Admin'})
+    events = [activate_event(first_id + i, admin) for i in range(users)]
+    batches = [[e, e] for e in events[:args.requests // 2]]
+    return 'activate-card', batches, events[args.requests // 2:]
+
+
+def scenario_webhook_mix(args: argparse.Namespace, rng: random.Random) -> Tuple[str, List[List[Event]], List[Event]]:
+    users = max(args.requests // 10, 1)
+    first_id = next_user_block(args.database_url)
+    seed_users(args.database_url, first_id, users)
+    events = webhook_events(rng, first_id, users, args.requests + args.alloc_requests)
+    return 'telegram-bot', [[e] for e in events[:args.requests]], events[args.requests:]
+
+
+SCENARIOS = {
+    'balance-read': scenario_balance_read,
+    'balance-create': scenario_balance_create,
+    'activate-burst': scenario_activate_burst,
+    'webhook-mix': scenario_webhook_mix,
+}
+
+REGRESSION_METRICS = ('p95_ms', 'db_round_trips_per_request', 'alloc_peak_kb_per_request')
+
+
+def regressions(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    found = []
+    for name, result in report['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        for metric in REGRESSION_METRICS:
+            if base.get(metric) and result.get(metric, 0) > base[metric] * (1 + max_regression):
+                found.append(f'{name}.{metric}: {base[metric]} -> {result[metric]}')
+    return found
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''))
+    parser.add_argument('--migrate', action='store_true', help='apply db_migrations to an empty database')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--alloc-requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--telegram-latency-ms', type=float, default=20.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON report to this file')
+    parser.add_argument('--baseline', help='JSON report to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+    if args.migrate:
+        migrate(args.database_url)
+
+    os.environ.update({
+        'DATABASE_URL': args.database_url,
+        'TELEGRAM_BOT_TOKEN': BOT_TOKEN,
+        'TELEGRAM_API_URL': start_stub_telegram(args.telegram_latency_ms),
+        'ADMIN_TELEGRAM_IDS': str(ADMIN_ID),
+        'RATE_LIMIT_ENABLED': '0',
+        'DB_POOL_MAX_SIZE': str(args.concurrency * 2),
+    })
+    psycopg2.connect = counting_connect
+
+    rng = random.Random(args.seed)
+    report: Dict[str, Any] = {
+        'python': sys.version.split()[0],
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'telegram_latency_ms': args.telegram_latency_ms,
+        'scenarios': {},
+    }
+    for name in args.scenarios.split(','):
+        function, batches, alloc_events = SCENARIOS[name](args, rng)
+        handler = load_handler(function)
+        result = run_requests(handler, batches, args.concurrency)
+        result.update(measure_allocations(handler, alloc_events))
+        report['scenarios'][name] = result
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            found = regressions(report, json.load(f), args.max_regression)
+        for line in found:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+'''
+Business: Замер индексов таблицы users до и после миграции - планы запросов горячего пути и скорость записи
+Args: --database-url (пустая отдельная база), --migration (версия, которую сравниваем), --through (последняя
+      применяемая версия), --users, --inserts, --updates, --output
+Returns: JSON: для каждого запроса тип узла плана, индекс, время и чтения из кучи; вставок и
+         обновлений баланса в секунду; размер индексов
+
+Сначала применяются миграции до --migration, таблица заполняется и проверяются запросы,
+затем применяется сама миграция (и последующие до --through) и те же замеры повторяются на тех же данных.
+'''
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATIONS = os.path.join(ROOT, 'db_migrations')
+
+SEED_SQL = '''
+    INSERT INTO users (telegram_id, first_name, referral_code, referred_by, card_ordered, card_activated,
+                       balance, created_at)
+    SELECT g, 'Bench', 'S' || g,
+        CASE WHEN g %% 4 = 0 THEN %(first)s + (g * 7919) %% %(count)s END,
+        g %% 10 < 6, g %% 10 < 5,
+        CASE WHEN g %% 10 < 5 THEN 500 ELSE 0 END,
+        CURRENT_TIMESTAMP - make_interval(secs => (g - %(first)s)::float8 * 5184000 / %(count)s)
+    FROM generate_series(%(first)s::bigint, %(first)s::bigint + %(count)s - 1) g
+'''
+
+QUERIES = {
+    'get-balance': (
+        '''
+        SELECT balance, card_ordered, card_activated, referral_code, first_name, referral_count, updated_at
+        FROM users
+        WHERE telegram_id = %(telegram_id)s
+        ''',
+        lambda first, count: {'telegram_id': first + count // 2},
+    ),
+    'referrals': (
+        'SELECT telegram_id FROM users WHERE referred_by = %(telegram_id)s',
+        lambda first, count: {'telegram_id': first + (4 * 7919) % count},
+    ),
+    'awaiting-activation-funnel': (
+        '''
+        SELECT date_trunc('day', created_at) AS day, COUNT(*)
+        FROM users
+        WHERE card_ordered AND card_activated IS NOT TRUE
+            AND created_at >= CURRENT_TIMESTAMP - INTERVAL '7 days'
+        GROUP BY 1
+        ''',
+        lambda first, count: {},
+    ),
+}
+
+INSERT_SQL = '''
+    INSERT INTO users (telegram_id, username, first_name, referral_code)
+    VALUES (%s, '', 'Bench', %s)
+    ON CONFLICT DO NOTHING
+'''
+
+UPDATE_SQL = '''
+    UPDATE users SET balance = balance + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE telegram_id = %s
+'''
+
+
+def apply_migrations(cur: Any, up_to: Optional[str] = None, after: Optional[str] = None,
+                     through: Optional[str] = None) -> List[str]:
+    applied = []
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS, 'V*.sql'))):
+        version = os.path.basename(path).split('__')[0]
+        if (up_to and version >= up_to) or (after and version < after) or (through and version > through):
+            continue
+        with open(path, encoding='utf-8') as f:
+            cur.execute(f.read())
+        applied.append(version)
+    return applied
+
+
+def plan_summary(plan: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Business: Сводка EXPLAIN (ANALYZE, BUFFERS): узлы сканирования, индексы, чтения из кучи
+    '''
+    scans: List[Dict[str, Any]] = []
+
+    def walk(node: Dict[str, Any]) -> None:
+        if 'Scan' in node['Node Type']:
+            scans.append({
+                'node': node['Node Type'],
+                'index': node.get('Index Name'),
+                'rows': node.get('Actual Rows'),
+                'heap_fetches': node.get('Heap Fetches'),
+            })
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(plan['Plan'])
+    return {
+        'scans': scans,
+        'execution_ms': round(plan['Execution Time'], 3),
+        'shared_buffers_hit': plan['Plan'].get('Shared Hit Blocks', 0),
+        'shared_buffers_read': plan['Plan'].get('Shared Read Blocks', 0),
+    }
+
+
+def explain(cur: Any, first: int, count: int, repeat: int = 20) -> Dict[str, Any]:
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        timings = []
+        for _ in range(repeat):
+            cur.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params(first, count))
+            plan = cur.fetchone()[0][0]
+            timings.append(plan['Execution Time'])
+        summary = plan_summary(plan)
+        summary['execution_ms'] = round(sorted(timings)[len(timings) // 2], 3)
+        results[name] = summary
+    return results
+
+
+def update_counters(cur: Any) -> Tuple[int, int]:
+    '''
+    Business: Счётчики HOT- и всех обновлений users, включая ещё не сброшенную статистику этой сессии
+    '''
+    cur.execute('SELECT pg_stat_force_next_flush()')
+    cur.execute('SELECT pg_stat_clear_snapshot()')
+    cur.execute("SELECT n_tup_hot_upd, n_tup_upd FROM pg_stat_user_tables WHERE relname = 'users'")
+    return cur.fetchone()
+
+
+def write_throughput(conn: Any, first: int, inserts: int, updates: int, existing: int) -> Dict[str, float]:
+    '''
+    Business: Вставки по одной строке с фиксацией каждой (как get-balance) и обновления баланса (как ledger)
+    Args: соединение в autocommit, первый telegram_id для вставок, число вставок и обновлений
+    '''
+    with conn.cursor() as cur:
+        started = time.perf_counter()
+        for telegram_id in range(first, first + inserts):
+            cur.execute(INSERT_SQL, (telegram_id, f'I{telegram_id}'))
+        insert_seconds = time.perf_counter() - started
+
+        hot_before, upd_before = update_counters(cur)
+        started = time.perf_counter()
+        for i in range(updates):
+            cur.execute(UPDATE_SQL, (existing + (i * 7919) % inserts,))
+        update_seconds = time.perf_counter() - started
+        hot_after, upd_after = update_counters(cur)
+    return {
+        'inserts_per_second': round(inserts / insert_seconds, 1),
+        'updates_per_second': round(updates / update_seconds, 1),
+        'hot_update_ratio': round((hot_after - hot_before) / max(upd_after - upd_before, 1), 3),
+    }
+
+
+def index_sizes(cur: Any) -> Dict[str, int]:
+    cur.execute('''
+        SELECT indexrelid::regclass::text, pg_relation_size(indexrelid)
+        FROM pg_index WHERE indrelid = 'users'::regclass
+        ORDER BY 1
+    ''')
+    return {name: size // 1024 for name, size in cur.fetchall()}
+
+
+def measure(conn: Any, first: int, count: int, insert_first: int, args: argparse.Namespace) -> Dict[str, Any]:
+    with conn.cursor() as cur:
+        cur.execute('VACUUM ANALYZE users')
+        plans = explain(cur, first, count)
+    writes = write_throughput(conn, insert_first, args.inserts, args.updates, insert_first)
+    with conn.cursor() as cur:
+        sizes = index_sizes(cur)
+    return {'plans': plans, 'writes': writes, 'index_kb': sizes}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''))
+    parser.add_argument('--migration', default='V0009')
+    parser.add_argument('--through', help='last migration of the "after" run (default: all of them)')
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--inserts', type=int, default=5000)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--output', help='write JSON report to this file')
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+
+    first = 8_000_000_000
+    conn = psycopg2.connect(args.database_url)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('users') IS NOT NULL")
+        if cur.fetchone()[0]:
+            parser.error('the database must be empty: migrations are applied by this script')
+        before_versions = apply_migrations(cur, up_to=args.migration)
+        cur.execute(SEED_SQL, {'first': first, 'count': args.users})
+
+    report: Dict[str, Any] = {'users': args.users, 'inserts': args.inserts, 'updates': args.updates}
+    report['before'] = {'migrations': before_versions[-1],
+                        **measure(conn, first, args.users, first + args.users, args)}
+
+    with conn.cursor() as cur:
+        after_versions = apply_migrations(cur, after=args.migration, through=args.through)
+    report['after'] = {'migrations': after_versions[-1],
+                       **measure(conn, first, args.users, first + args.users + args.inserts, args)}
+    conn.close()
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
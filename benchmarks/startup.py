@@ -0,0 +1,113 @@
+'''
+Business: Замер холодного старта функций backend/ - импорт index.py и первый вызов handler
+Args: --runs N, --functions a,b, --against <git ref> для сравнения с другой ревизией
+Returns: JSON с медианой и p95 по каждой функции (и по ревизии сравнения)
+
+Каждый замер - отдельный процесс python, как при холодном старте на платформе.
+Первый вызов - OPTIONS-запрос, он не требует базы данных и Telegram;
+warm_call_us - среднее время последующих вызовов того же запроса.
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import io
+from typing import Dict, Any, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, sys, time
+t0 = time.perf_counter()
+import index
+t1 = time.perf_counter()
+index.handler({'httpMethod': 'OPTIONS', 'headers': {}}, None)
+t2 = time.perf_counter()
+for _ in range(1000):
+    index.handler({'httpMethod': 'OPTIONS', 'headers': {}}, None)
+t3 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'first_call_us': (t2 - t1) * 1000000,
+    'warm_call_us': (t3 - t2) * 1000,
+    'modules': len(sys.modules),
+}))
+'''
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def probe(function_dir: str) -> Dict[str, float]:
+    env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+    env.setdefault('DATABASE_URL', 'postgresql://localhost/startup-benchmark')
+    env.setdefault('TELEGRAM_BOT_TOKEN', 'startup-benchmark')
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        cwd=function_dir, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(backend_dir: str, functions: List[str], runs: int) -> Dict[str, Any]:
+    report = {}
+    for name in functions:
+        function_dir = os.path.join(backend_dir, name)
+        if not os.path.exists(os.path.join(function_dir, 'index.py')):
+            continue
+        probe(function_dir)
+        samples = [probe(function_dir) for _ in range(runs)]
+        total = [s['import_ms'] + s['first_call_us'] / 1000 for s in samples]
+        report[name] = {
+            'import_ms': round(statistics.median(s['import_ms'] for s in samples), 2),
+            'first_call_us': round(statistics.median(s['first_call_us'] for s in samples), 2),
+            'total_ms_p50': round(statistics.median(total), 2),
+            'total_ms_p95': round(percentile(total, 0.95), 2),
+            'warm_call_us': round(statistics.median(s['warm_call_us'] for s in samples), 2),
+            'modules': samples[-1]['modules'],
+        }
+    return report
+
+
+def extract_backend(ref: str, target: str) -> str:
+    archive = subprocess.run(
+        ['git', 'archive', ref, 'backend'], cwd=ROOT, capture_output=True, check=True
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(target)
+    return os.path.join(target, 'backend')
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--functions', default='')
+    parser.add_argument('--against', help='git ref to compare with, e.g. HEAD~1')
+    args = parser.parse_args(argv)
+
+    backend_dir = os.path.join(ROOT, 'backend')
+    functions = [f for f in args.functions.split(',') if f] or sorted(os.listdir(backend_dir))
+
+    report: Dict[str, Any] = {'python': sys.version.split()[0], 'runs': args.runs}
+    report['current'] = measure(backend_dir, functions, args.runs)
+
+    if args.against:
+        with tempfile.TemporaryDirectory() as tmp:
+            report[args.against] = measure(extract_backend(args.against, tmp), functions, args.runs)
+        report['speedup'] = {
+            name: round(report[args.against][name]['total_ms_p50'] / stats['total_ms_p50'], 2)
+            for name, stats in report['current'].items()
+            if name in report[args.against] and stats['total_ms_p50']
+        }
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+ALTER TABLE users ADD COLUMN IF NOT EXISTS referral_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE users u
+SET referral_count = r.referrals
+FROM (
+    SELECT referred_by, COUNT(*) AS referrals
+    FROM users
+    WHERE referred_by IS NOT NULL
+    GROUP BY referred_by
+) r
+WHERE u.telegram_id = r.referred_by;
+
+CREATE INDEX IF NOT EXISTS idx_users_referred_by ON users(referred_by);
+CREATE INDEX IF NOT EXISTS idx_users_referral_leaderboard ON users(referral_count DESC, telegram_id) WHERE referral_count > 0;
+
+CREATE TABLE IF NOT EXISTS pending_referrals (
+    telegram_id BIGINT PRIMARY KEY,
+    referral_code VARCHAR(50) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,19 @@
+CREATE TABLE IF NOT EXISTS balance_transactions (
+    id BIGSERIAL PRIMARY KEY,
+    telegram_id BIGINT NOT NULL,
+    amount DECIMAL(10, 2) NOT NULL,
+    kind VARCHAR(50) NOT NULL,
+    idempotency_key VARCHAR(255) UNIQUE NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_balance_transactions_user ON balance_transactions(telegram_id, id DESC);
+
+INSERT INTO balance_transactions (telegram_id, amount, kind, idempotency_key)
+SELECT telegram_id, balance, 'opening_balance', 'opening_balance:' || telegram_id
+FROM users
+WHERE balance <> 0
+ON CONFLICT (idempotency_key) DO NOTHING;
+
+UPDATE users SET balance = 0 WHERE balance IS NULL;
+ALTER TABLE users ALTER COLUMN balance SET NOT NULL;
@@ -0,0 +1,21 @@
+ALTER TABLE users ADD CONSTRAINT users_balance_non_negative CHECK (balance >= 0);
+
+CREATE TABLE IF NOT EXISTS withdrawals (
+    id BIGSERIAL PRIMARY KEY,
+    telegram_id BIGINT NOT NULL,
+    amount DECIMAL(10, 2) NOT NULL CHECK (amount > 0),
+    phone VARCHAR(20) NOT NULL,
+    bank VARCHAR(50) NOT NULL,
+    idempotency_key VARCHAR(255) UNIQUE NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    payout_id VARCHAR(255),
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_withdrawals_queue ON withdrawals(available_at) WHERE status IN ('pending', 'processing');
+CREATE INDEX IF NOT EXISTS idx_withdrawals_user ON withdrawals(telegram_id, id DESC);
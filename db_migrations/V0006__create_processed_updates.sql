@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_key VARCHAR(80) PRIMARY KEY,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_processed_updates_created_at ON processed_updates(created_at);
@@ -0,0 +1,5 @@
+DROP INDEX IF EXISTS idx_telegram_id;
+DROP INDEX IF EXISTS idx_referral_code;
+
+CREATE INDEX IF NOT EXISTS idx_users_card_awaiting_activation ON users(created_at)
+    WHERE card_ordered AND card_activated IS NOT TRUE;
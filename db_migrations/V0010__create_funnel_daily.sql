@@ -0,0 +1,23 @@
+CREATE TABLE IF NOT EXISTS funnel_daily (
+    day DATE PRIMARY KEY,
+    joined INTEGER NOT NULL DEFAULT 0,
+    card_ordered INTEGER NOT NULL DEFAULT 0,
+    card_activated INTEGER NOT NULL DEFAULT 0,
+    referred INTEGER NOT NULL DEFAULT 0,
+    referrers INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS rollup_watermarks (
+    name VARCHAR(64) PRIMARY KEY,
+    high_water TIMESTAMP NOT NULL,
+    runs BIGINT NOT NULL DEFAULT 0,
+    rows_processed BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO rollup_watermarks (name, high_water)
+VALUES ('funnel_daily', '1970-01-01')
+ON CONFLICT (name) DO NOTHING;
+
+CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at);
@@ -0,0 +1,20 @@
+ALTER TABLE users ADD COLUMN IF NOT EXISTS card_status VARCHAR(20) NOT NULL DEFAULT 'none';
+
+UPDATE users
+SET card_status = CASE WHEN card_activated THEN 'activated' ELSE 'ordered' END
+WHERE card_status = 'none' AND (card_activated OR card_ordered);
+
+ALTER TABLE users ADD CONSTRAINT users_card_status_check
+    CHECK (card_status IN ('none', 'ordered', 'issued', 'activated'));
+
+CREATE TABLE IF NOT EXISTS card_status_events (
+    idempotency_key VARCHAR(255) PRIMARY KEY,
+    telegram_id BIGINT NOT NULL,
+    from_status VARCHAR(20) NOT NULL,
+    to_status VARCHAR(20) NOT NULL,
+    source VARCHAR(20) NOT NULL,
+    applied BOOLEAN NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_card_status_events_user ON card_status_events(telegram_id, created_at DESC);
@@ -0,0 +1 @@
+ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS deferred BIGINT[] NOT NULL DEFAULT '{}';
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS idx_card_status_events_created_at ON card_status_events(created_at);
@@ -4,6 +4,7 @@ declare global {
   interface Window {
     Telegram?: {
       WebApp: {
+        initData: string;
         initDataUnsafe: {
           user?: {
             id: number;
@@ -11,6 +12,7 @@ declare global {
             last_name?: string;
             username?: string;
           };
+          start_param?: string;
         };
         ready: () => void;
         expand: () => void;
@@ -45,6 +47,7 @@ export default function Index() {
   useEffect(() => {
     const tg = window.Telegram?.WebApp;
     let telegramId: number | null = null;
+    let initData = '';
     
     if (tg) {
       tg.ready();
@@ -55,6 +58,7 @@ export default function Index() {
         telegramId = user.id;
         setUserName(user.first_name || 'Пользователь');
       }
+      initData = tg.initData;
     }
     
     const urlParams = new URLSearchParams(window.location.search);
@@ -63,8 +67,10 @@ export default function Index() {
       setCurrentPage(pageParam);
     }
     
-    if (telegramId) {
-      fetch(`https://functions.poehali.dev/3b79a6e9-d6a0-4a34-9702-2ba8913a5324?telegram_id=${telegramId}&first_name=${encodeURIComponent(userName)}`)
+    if (telegramId && initData) {
+      fetch('https://functions.poehali.dev/3b79a6e9-d6a0-4a34-9702-2ba8913a5324', {
+        headers: { 'X-Telegram-Init-Data': initData }
+      })
         .then(res => res.json())
         .then(data => {
           if (data.balance !== undefined) {
@@ -658,7 +664,10 @@ export default function Index() {
                     
                     fetch('https://functions.poehali.dev/6594e70a-dcf3-43db-ab95-f82fec90fd7c', {
                       method: 'POST',
-                      headers: { 'Content-Type': 'application/json' },
+                      headers: {
+                        'Content-Type': 'application/json',
+                        'X-Telegram-Init-Data': window.Telegram?.WebApp.initData || ''
+                      },
                       body: JSON.stringify({ telegram_id: parseInt(telegramId) })
                     })
                       .then(res => res.json())